@@ -8,18 +8,15 @@ from metpy.units import units
 import metpy.calc as mpcalc
 from netCDF4 import num2date
 import numpy as np
-from siphon.catalog import TDSCatalog
-from siphon.ncss import NCSS
+import os
+import sys
 import scipy.ndimage as ndimage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tds_catalog import get_ncss  # noqa: E402
 
-gfs = TDSCatalog('http://atm.ucar.edu/thredds/catalog/grib/'
-                 'NCEP/GFS/Global_0p25deg/catalog.xml')
-
-dataset = list(gfs.datasets.values())[1]
-print(dataset.access_urls)
-
-# Create NCSS object to access the NetcdfSubset
-ncss = NCSS(dataset.access_urls['NetcdfSubset'])
+# Create NCSS object to access the NetcdfSubset (second dataset of the catalog)
+ncss = get_ncss('http://atm.ucar.edu/thredds/catalog/grib/'
+                'NCEP/GFS/Global_0p25deg/catalog.xml', dataset=1)
 
 # get current date and time
 now = datetime.utcnow()
@@ -5,25 +5,19 @@ from matplotlib.dates import AutoDateLocator, DateFormatter
 import matplotlib.pyplot as plt
 import metpy.calc as mpcalc
 from metpy.units import units
-from siphon.catalog import TDSCatalog
-from siphon.ncss import NCSS
 from metpy.calc import get_wind_components
 from metpy.calc import reduce_point_density
 from metpy.cbook import get_test_data
 from metpy.plots import add_metpy_logo, StationPlot
-from metpy.plots.wx_symbols import current_weather, sky_cover, wx_code_map
+from metpy.plots.wx_symbols import current_weather, sky_cover
 from metpy.units import units
+from metar_read_data import weather_codes
+from metar_download import METAR_CATALOG
+from tds_catalog import get_ncss
 
 # Request METAR data from TDS
-metar = TDSCatalog('http://thredds.ucar.edu/thredds/catalog/nws/metar/'
-                   'ncdecoded/catalog.xml')
-dataset = list(metar.datasets.values())[0]
-print(list(dataset.access_urls))
-
 # Access netcdf subset and use siphon to request data
-ncss_url = dataset.access_urls['NetcdfSubset']
-ncss = NCSS(ncss_url)
-print(ncss.variables)
+ncss = get_ncss(METAR_CATALOG)
 
 # get current date and time
 now = datetime.utcnow()
@@ -57,8 +51,7 @@ cloud_frac = cloud_frac.astype(int)
 # Extract weather as strings
 weather = chartostring(data['weather'][:])
 # Map weather strings to WMO codes, which we can use to convert to symbols
-# Only use the first symbol if there are multiple
-wx = [wx_code_map[s.split()[0] if ' ' in s else s] for s in weather]
+wx = weather_codes(weather)
 # Get time into a datetime object
 time = [datetime.fromtimestamp(t) for t in data['time'][0]]
 time = sorted(time)
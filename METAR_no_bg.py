@@ -1,19 +1,22 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+import time
 import numpy as np
 import cartopy.crs as ccrs
 import cartopy.feature as feat
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as path_effects
-import pandas as pd
 from metpy.units import units
-from siphon.catalog import TDSCatalog
-from siphon.ncss import NCSS
 from metpy.calc import get_wind_components,  reduce_point_density
-from metpy.plots.wx_symbols import current_weather, sky_cover, wx_code_map
+from metpy.plots.wx_symbols import current_weather, sky_cover
 from metpy.plots import StationPlot
 from os.path import expanduser
 import os
 from synop_read_data import synop_df
+from synop_download import url_last_hour, download_and_save
+from metar_download import get_data, METAR_CATALOG
+from tds_catalog import get_ncss
+from metar_read_data import weather_codes
 # Request METAR data from TDS
 # os.system(wget -N http://thredds.ucar.edu/thredds/fileServer/nws/metar/
 # ncdecoded/files/Surface_METAR_20171130_0000.nc')
@@ -27,15 +30,9 @@ except FileNotFoundError:
 
 
 def build_query(west=-58.5, east=32, south=42, north=74):
-    metar = TDSCatalog('http://thredds.ucar.edu/thredds/catalog/nws/metar/'
-                       'ncdecoded/catalog.xml')
-    dataset = list(metar.datasets.values())[0]
-    print(list(dataset.access_urls))
-
-    # Access netcdf subset and use siphon to request data
-    ncss_url = dataset.access_urls['NetcdfSubset']
-    ncss = NCSS(ncss_url)
-    print(ncss.variables)
+    # Access netcdf subset and use siphon to request data, the catalog and
+    # the dataset description are shared by all queries
+    ncss = get_ncss(METAR_CATALOG)
 
     # get current date and time
     now = datetime.utcnow()
@@ -49,41 +46,10 @@ def build_query(west=-58.5, east=32, south=42, north=74):
                     'precipitation_amount_hourly', 'hectoPascal_ALTIM',
                     'air_pressure_at_sea_level', 'wind_from_direction',
                     'cloud_area_fraction', 'weather', 'report', 'wind_gust')
-    query.accept('csv')
+    query.accept('netcdf')
     return ncss, query
 
 
-def get_data(ncss, query, density=50000.):
-    attempts = 0
-    success = False
-    while attempts <= 5 and not success:
-        try:
-            # Get the netcdf dataset
-            data = ncss.get_data(query)
-            # convert into pandas dataframe
-            df = pd.DataFrame(data)
-            success = True
-        except ValueError:
-            attempts += 1
-            print('Not the right amount of columns, trying for the {} time'
-                  .format(attempts))
-
-    df = df.replace(-99999, np.nan)
-    df = df.dropna(how='any', subset=['wind_from_direction', 'wind_speed',
-                   'dew_point_temperature'])
-    df['cloud_area_fraction'] = (df['cloud_area_fraction'] * 8)
-    df['cloud_area_fraction'] = df['cloud_area_fraction'].replace(np.nan, 10) \
-        .astype(int)
-    # Get the columns with strings and decode
-    str_df = df.select_dtypes([np.object])
-    str_df = str_df.stack().str.decode('utf-8').unstack()
-    # Replace decoded columns in PlateCarree
-    for col in str_df:
-        df[col] = str_df[col]
-
-    return df
-
-
 def reduce_density(df, dens, projection='EU'):
     if projection == 'GR':
         proj = ccrs.LambertConformal(central_longitude=-35,
@@ -102,22 +68,56 @@ def reduce_density(df, dens, projection='EU'):
     return proj, point_locs, df
 
 
-df_synop = synop_df()
-df_synop_red = reduce_density(df_synop, 50000, 'GR')
+def get_metar_and_synop(west=-58.5, east=32, south=42, north=74):
+    '''
+    Requests the METARs from TDS and downloads the SYNOPs of the last hour
+    from Ogimet at the same time. The SYNOPs are decoded in a separate
+    process, so the METAR request and the decoding do not wait for each
+    other. Returns as soon as both are ready.
+
+    Arguments:
+    ----------
+    west=-58.5, east=32, south=42, north=74 (box of the METAR query)
+
+    Returns:
+    --------
+    df_metar (see metar_download.get_data)
+    df_synop (see synop_read_data.synop_df)
+
+    Examples:
+    ---------
+    df_tot, df_synop = get_metar_and_synop()
+
+    '''
+    start = time.time()
+
+    def metar():
+        df_metar = get_data(*build_query(west, east, south, north))
+        print('METAR data ready after {:.1f} s.'.format(time.time() - start))
+        return df_metar
+
+    def synop():
+        url, path_data = url_last_hour()
+        download_and_save(path_data, url)
+        df_synop, df_climat = decode_pool.submit(synop_df, path_data).result()
+        print('SYNOP data ready after {:.1f} s.'.format(time.time() - start))
+        return df_synop
+
+    with ProcessPoolExecutor(1) as decode_pool:
+        # Start the worker process before any thread, so it is not forked
+        # from a multithreaded process
+        decode_pool.submit(os.getpid).result()
+        with ThreadPoolExecutor(2) as io_pool:
+            df_metar = io_pool.submit(metar)
+            df_synop = io_pool.submit(synop)
+            return df_metar.result(), df_synop.result()
 
 
 def plot_map_metar_and_synop(proj, point_locs, df_t, df_synop, area='EU', west=-5.5, east=32,
                       south=42, north=62, fonts=14):
     df = df_t
     # Map weather strings to WMO codes, which we can use to convert to symbols
-    # Only use the first symbol if there are multiple
-    df['weather'] = df['weather'].str.replace('-SG', 'SG')
-    df['weather'] = df['weather'].str.replace('FZBR', 'FZFG')
-    df['weather'] = df['weather'].str.replace('-BLSN', 'BLSN')
-    df['weather'] = df['weather'].str.replace('-DRSN', 'DRSN')
-    df['weather'] = df['weather'].str.replace('-FZUP', 'FZDZ')
-    wx = [wx_code_map[s.split()[0] if ' ' in s else s] for s in df['weather']
-          .fillna('')]
+    wx = weather_codes(df['weather'])
     wx2 = df_synop['ww'].fillna(0).astype(int)
     wx2 = wx2.values.tolist()
     # Get the wind components, converting from m/s to knots as will
@@ -215,14 +215,7 @@ def plot_map_standard(proj, point_locs, df_t, area='EU', west=-5.5, east=32,
                       south=42, north=62, fonts=14):
     df = df_t
     # Map weather strings to WMO codes, which we can use to convert to symbols
-    # Only use the first symbol if there are multiple
-    df['weather'] = df['weather'].str.replace('-SG', 'SG')
-    df['weather'] = df['weather'].str.replace('FZBR', 'FZFG')
-    df['weather'] = df['weather'].str.replace('-BLSN', 'BLSN')
-    df['weather'] = df['weather'].str.replace('-DRSN', 'DRSN')
-    df['weather'] = df['weather'].str.replace('-FZUP', 'FZDZ')
-    wx = [wx_code_map[s.split()[0] if ' ' in s else s] for s in df['weather']
-          .fillna('')]
+    wx = weather_codes(df['weather'])
     # Get the wind components, converting from m/s to knots as will
     # be appropriate for the station plot.
     u, v = get_wind_components(((df['wind_speed'].values)*units('m/s'))
@@ -293,17 +286,13 @@ def plot_map_standard(proj, point_locs, df_t, area='EU', west=-5.5, east=32,
 
 
 if __name__ == '__main__':
-    # First try of synop and metar plot
-    ncss, query = build_query()
-    df_tot = get_data(ncss, query)
-    df_synop = synop_df()
+    # First try of synop and metar plot, both sources are fetched at once
+    df_tot, df_synop = get_metar_and_synop()
     proj2, point_locs2, df_synop_red = reduce_density(df_synop, 180000)
     proj, point_locs, df = reduce_density(df_tot, 180000)
     plot_map_metar_and_synop(proj, point_locs, df, df_synop_red, area='EU', fonts=15)
 
-
-    ncss, query = build_query()
-    df_tot = get_data(ncss, query)
+    # The METAR maps use the same query
     proj, point_locs, df = reduce_density(df_tot, 180000)
     plot_map_standard(proj, point_locs, df, area='EU', fonts=15)
 
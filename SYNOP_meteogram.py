@@ -13,7 +13,7 @@ from metpy.units import units
 import pandas as pd
 
 from synop_read_data import synop_df
-from synop_download import download_and_save, url_timeseries
+from synop_download import download_station
 
 #
 # def calc_mslp(t, p, h):
@@ -199,10 +199,11 @@ class Meteogram(object):
 
 # Download the station data
 station = '04360' #'04416'  # '89606'# '03065' #04201
-url, path = url_timeseries(2020, 4, 20, 00, 2020, 4, 27, 10, station)
-# yields an error (many not a time entries)
-download_and_save(path, url)
+start, end = dt.datetime(2020, 4, 20, 00), dt.datetime(2020, 4, 27, 10)
+# Only the hours not stored yet are downloaded
+path = download_station(station, start, end)
 df_synop, df_climat = synop_df(path, timeseries=True)
+df_synop = df_synop[(df_synop.time >= start) & (df_synop.time <= end)].reset_index(drop=True)
 # Temporary variables for ease
 temp = df_synop['TT'].values * units('degC')
 pres = df_synop['SLP'].values
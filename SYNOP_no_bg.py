@@ -1,6 +1,5 @@
 from datetime import datetime
 import numpy as np
-import time
 import cartopy.crs as ccrs
 import cartopy.feature as feat
 import matplotlib.pyplot as plt
@@ -8,15 +7,14 @@ import matplotlib.patheffects as path_effects
 import matplotlib.path as mpath
 import pandas as pd
 from metpy.units import units
-from siphon.catalog import TDSCatalog
-from siphon.ncss import NCSS
 from metpy.calc import wind_components,  reduce_point_density
-from metpy.interpolate import interpolate_to_grid, remove_nan_observations
 from metpy.plots.wx_symbols import current_weather, current_weather_auto, sky_cover
 from metpy.plots import StationPlot
 from os.path import expanduser
 import os
 from synop_read_data import synop_df
+from metar_download import METAR_CATALOG
+from tds_catalog import get_ncss
 from synop_download import url_last_hour, url_any_hour, download_and_save
 #
 # Suppress pd chained_assignment warnings
@@ -34,15 +32,9 @@ except FileNotFoundError:
 
 
 def build_query(west=-58.5, east=32, south=42, north=74):
-    metar = TDSCatalog('http://thredds.ucar.edu/thredds/catalog/nws/metar/'
-                       'ncdecoded/catalog.xml')
-    dataset = list(metar.datasets.values())[0]
-    print(list(dataset.access_urls))
-
-    # Access netcdf subset and use siphon to request data
-    ncss_url = dataset.access_urls['NetcdfSubset']
-    ncss = NCSS(ncss_url)
-    print(ncss.variables)
+    # Access netcdf subset and use siphon to request data, the catalog and
+    # the dataset description are shared by all queries
+    ncss = get_ncss(METAR_CATALOG)
 
     # get current date and time
     now = datetime.utcnow()
@@ -56,56 +48,46 @@ def build_query(west=-58.5, east=32, south=42, north=74):
                     'precipitation_amount_hourly', 'hectoPascal_ALTIM',
                     'air_pressure_at_sea_level', 'wind_from_direction',
                     'cloud_area_fraction', 'weather', 'report', 'wind_gust')
-    query.accept('csv')
+    query.accept('netcdf')
     return ncss, query
 
 
-def get_data(ncss, query, density=50000.):
-    attempts = 0
-    success = False
-    while attempts <= 5 and not success:
-        try:
-            # Get the netcdf dataset
-            data = ncss.get_data(query)
-            # convert into pandas dataframe
-            df = pd.DataFrame(data)
-            success = True
-        except ValueError:
-            attempts += 1
-            print('Not the right amount of columns, trying for the {} time'
-                  .format(attempts))
-
-    df = df.replace(-99999, np.nan)
-    df = df.dropna(how='any', subset=['wind_from_direction', 'wind_speed',
-                                      'dew_point_temperature'])
-    df['cloud_area_fraction'] = (df['cloud_area_fraction'] * 8)
-    df['cloud_area_fraction'] = df['cloud_area_fraction'].replace(np.nan, 10) \
-        .astype(int)
-    # Get the columns with strings and decode
-    str_df = df.select_dtypes([np.object])
-    str_df = str_df.stack().str.decode('utf-8').unstack()
-    # Replace decoded columns in PlateCarree
-    for col in str_df:
-        df[col] = str_df[col]
-
-    return df
+# Projections and map features are created once per process and reused
+_projections = {}
+_features = {}
+
+
+def get_projection(projection='EU'):
+    '''Returns the (cached) cartopy projection used for the station density.'''
+    if projection not in _projections:
+        if (projection == 'GR') or (projection == 'Arctic'):
+            proj = ccrs.LambertConformal(central_longitude=-35,
+                                         central_latitude=65,
+                                         standard_parallels=[35])
+        elif projection == 'Antarctica':
+            proj = ccrs.SouthPolarStereo()
+        elif projection == 'NorthPolarStereo':
+            proj = ccrs.NorthPolarStereo()
+        else:
+            proj = ccrs.LambertConformal(central_longitude=13, central_latitude=47,
+                                         standard_parallels=[35])
+        _projections[projection] = proj
+    return _projections[projection]
+
+
+def get_features():
+    '''Returns the (cached) coastline, ocean and border features of the maps.'''
+    if not _features:
+        _features['coastline'] = feat.COASTLINE.with_scale('10m')
+        _features['ocean'] = feat.OCEAN.with_scale('50m')
+        _features['states'] = feat.STATES.with_scale('10m')
+    return _features
 
 
 def reduce_density(df, dens, south=-90, north=90, east=180, west=-180, projection='EU'):
     df_small = df[(df.latitude >= south) & (df.latitude <= north) & (
         df.longitude <= east) & (df.longitude >= west)]
-    if (projection == 'GR') or (projection == 'Arctic'):
-        proj = ccrs.LambertConformal(central_longitude=-35,
-                                     central_latitude=65,
-                                     standard_parallels=[35])
-    elif projection == 'Antarctica':
-        proj = ccrs.SouthPolarStereo()
-    # elif projection == 'Arctic':
-    #     proj = ccrs.NorthPolarStereo()
-
-    else:
-        proj = ccrs.LambertConformal(central_longitude=13, central_latitude=47,
-                                     standard_parallels=[35])
+    proj = get_projection(projection)
     # Use the cartopy map projection to transform station locations to the map
     # and then refine the number of stations plotted by setting a 300km radius
     point_locs = proj.transform_points(ccrs.PlateCarree(),
@@ -113,13 +95,14 @@ def reduce_density(df, dens, south=-90, north=90, east=180, west=-180, projectio
                                        df_small['latitude'].values)
     df = df_small[reduce_point_density(point_locs, dens)]
     if projection == 'Arctic':
-        proj = ccrs.NorthPolarStereo()
+        proj = get_projection('NorthPolarStereo')
 
     return proj, point_locs, df
 
 
 def plot_map_standard(proj, point_locs, df_t, area='EU', west=-9.5, east=28,
-                      south=35, north=62, fonts=14, path=None, SLP=False, gust=False):
+                      south=35, north=62, fonts=14, path=None, SLP=False, gust=False,
+                      filename=None):
     if path == None:
         # set up the paths and test for existence
         path = expanduser('~') + '/Documents/Metar_plots'
@@ -173,10 +156,10 @@ def plot_map_standard(proj, point_locs, df_t, area='EU', west=-9.5, east=28,
     #                                             alpha=0.5)
     # ax.coastlines(resolution='10m', zorder=0, color='black')
     # ax.add_feature(feat.LAND)
-    ax.add_feature(feat.COASTLINE.with_scale(
-        '10m'), zorder=2, edgecolor='black')
-    ax.add_feature(feat.OCEAN.with_scale('50m'), zorder=0)
-    ax.add_feature(feat.STATES.with_scale('10m'), zorder=1,
+    features = get_features()
+    ax.add_feature(features['coastline'], zorder=2, edgecolor='black')
+    ax.add_feature(features['ocean'], zorder=0)
+    ax.add_feature(features['states'], zorder=1,
                    facecolor='white', edgecolor='#5e819d')
     # ax.add_feature(cartopy.feature.OCEAN, zorder=0)
     # Set plot bounds
@@ -244,6 +227,7 @@ def plot_map_standard(proj, point_locs, df_t, area='EU', west=-9.5, east=28,
             stationplot.plot_symbol(
                 'W', wx2, current_weather_auto, zorder=4)
     if SLP == True:
+        from metpy.interpolate import interpolate_to_grid, remove_nan_observations
         lon = df['longitude'].loc[(
             df.PressureDefId == 'mean sea level') & (df.Hp <= 750)].values
         lat = df['latitude'].loc[(
@@ -274,17 +258,62 @@ def plot_map_standard(proj, point_locs, df_t, area='EU', west=-9.5, east=28,
     # directions, plot further out by specifying a location of 2 increments
     # in x and 0 in y.stationplot.plot_text((2, 0), df['station'])
 
+    if filename is None:
+        filename = 'CURR_SYNOP_' + area + '.png'
     if (area == 'Antarctica' or area == 'Arctic'):
-        plt.savefig(path + '/CURR_SYNOP_'+area+'.png',
+        plt.savefig(path + '/' + filename,
                     bbox_inches='tight', pad_inches=0)
     else:
-        plt.savefig(path + '/CURR_SYNOP_'+area+'.png',
+        plt.savefig(path + '/' + filename,
                     bbox_inches='tight', transparent="True", pad_inches=0)
+    # Free the figure, many maps may be drawn in one process
+    plt.close(fig)
+
+
+# Station density (m), reduce_density and plot_map_standard arguments per area
+AREAS = {
+    'SVA': (20000, dict(south=75, north=82, east=50, west=-50, projection='SVA'),
+            dict(west=4, east=36, south=75, north=81.5, fonts=16, SLP=True, gust=True)),
+    'UK': (35000, dict(south=49, north=61, east=30, west=-20),
+           dict(west=-10.1, east=1.8, south=50.1, north=58.4, fonts=11, SLP=True, gust=True)),
+    'AT': (30000, dict(south=45.5, north=50, east=60, west=0),
+           dict(west=8.9, east=17.42, south=45.9, north=49.4, fonts=12, SLP=True, gust=True)),
+    'EU': (160000, dict(south=30, north=65, east=50, west=-50),
+           dict(SLP=True)),
+    'GR_S': (60000, dict(south=50, north=85, east=50, west=-80, projection='GR'),
+             dict(west=-58, east=-23, south=58, north=70.5, fonts=16, SLP=False, gust=True)),
+    'GR_N': (60000, dict(south=50, north=85, east=50, west=-80, projection='GR'),
+             dict(west=-64, east=-18, south=70.5, north=84.5, fonts=16, SLP=False, gust=True)),
+    'Antarctica': (120000, dict(south=-90, north=-50, east=180, west=-180,
+                                projection='Antarctica'),
+                   dict(west=-180, east=180, south=-90, north=-60.0, fonts=16)),
+}
+
+
+def plot_area(df_synop, area, path=None, filename=None):
+    '''
+    Plots the SYNOP map of one of the AREAS.
+
+    Arguments:
+    ----------
+    df_synop (as returned by synop_df)
+    area (key of AREAS, e.g. 'AT')
+    path = None (directory of the plot, default ~/Documents/Metar_plots)
+    filename = None (name of the plot, default CURR_SYNOP_<area>.png)
+
+    Examples:
+    ---------
+    df_synop, df_climat = synop_df(path)
+    plot_area(df_synop, 'AT')
+
+    '''
+    density, reduce_kwargs, plot_kwargs = AREAS[area]
+    proj, point_locs, df_synop_red = reduce_density(df_synop, density, **reduce_kwargs)
+    plot_map_standard(proj, point_locs, df_synop_red, area=area, path=path,
+                      filename=filename, **plot_kwargs)
 
 
 if __name__ == '__main__':
-    attempts = 0
-    success = False
     text = '''
     This program can either plot the SYNOP observations for the last hour or for
     any given date.
@@ -292,19 +321,9 @@ if __name__ == '__main__':
     print(text)
     inp = input(
         'Do you want to plot observations from the last hour? (y/n): ')
+    # download_and_save retries and validates the download itself
     if inp == 'Y' or inp == 'y':
-        while attempts <= 5 and not success:
-            try:
-                url, path = url_last_hour()
-                download_and_save(path, url)
-                df_synop, df_climat = synop_df(path)
-                success = True
-            except ValueError:
-                attempts += 1
-                print('Not the right amount of columns, trying for the {} time'
-                      .format(attempts))
-                time.sleep(2)
-
+        url, path = url_last_hour()
     else:
         inp = input(
             'For which date do you want to plot the SYNOP observations? (YYYY/MM/DD/HH): ')
@@ -312,54 +331,17 @@ if __name__ == '__main__':
         # Remove leading zeros, e.g. MM = 05 for May
         inp = [int(x.lstrip('0')) for x in inp]
 
-        while attempts <= 5 and not success:
-            try:
-                url, path = url_any_hour(
-                    year=inp[0], month=inp[1], day=inp[2], hour=inp[3])
-                download_and_save(path, url)
-                df_synop, df_climat = synop_df(path)
-                success = True
-            except ValueError:
-                attempts += 1
-                print('Not the right amount of columns, trying for the {} time'
-                      .format(attempts))
-                time.sleep(2)
+        url, path = url_any_hour(
+            year=inp[0], month=inp[1], day=inp[2], hour=inp[3])
+    download_and_save(path, url)
+    df_synop, df_climat = synop_df(path)
 
     # # if specific date
     # url, path = url_any_hour(2007, 1, 18, 6)
     # download_and_save(path, url)
     # df_synop = synop_df(path)
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 20000, south=75, north=82, east=50, west=-50, projection='SVA')
-    plot_map_standard(proj, point_locs, df_synop_red, area='SVA', west=4, east=36,
-                      south=75, north=81.5,  fonts=16, SLP=True, gust=True)
-
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 35000, south=49, north=61, east=30, west=-20)
-    plot_map_standard(proj, point_locs, df_synop_red, area='UK', west=-10.1, east=1.8,
-                      south=50.1, north=58.4,  fonts=11, SLP=True, gust=True)
-
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 30000, south=45.5, north=50, east=60, west=0)
-    plot_map_standard(proj, point_locs, df_synop_red, area='AT', west=8.9, east=17.42,
-                      south=45.9, north=49.4, fonts=12, SLP=True, gust=True)
-
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 160000, south=30, north=65, east=50, west=-50)
-    plot_map_standard(proj, point_locs, df_synop_red,
-                      area='EU', SLP=True)
-
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 60000, south=50, north=85, east=50, west=-80, projection='GR')
-    plot_map_standard(proj, point_locs, df_synop_red, area='GR_S', west=-58, east=-23,
-                      south=58, north=70.5,  fonts=16, SLP=False, gust=True)
-    plot_map_standard(proj, point_locs, df_synop_red, area='GR_N', west=-64, east=-18,
-                      south=70.5, north=84.5,  fonts=16, SLP=False, gust=True)
-
-    proj, point_locs, df_synop_red = reduce_density(
-        df_synop, 120000, south=-90, north=-50, east=180, west=-180, projection='Antarctica')
-    plot_map_standard(proj, point_locs, df_synop_red, area='Antarctica', west=-180, east=180,
-                      south=-90, north=-60.0,  fonts=16)
+    for area in AREAS:
+        plot_area(df_synop, area)
 
     # proj, point_locs, df_synop_red = reduce_density(df_synop, 180000, 'Arctic')
     # plot_map_standard(proj, point_locs, df_synop_red, area='Arctic', west=-180, east=180,
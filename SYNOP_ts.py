@@ -1,18 +1,20 @@
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib.pyplot as plt
 import pandas as pd
 import glob
 import os
-from synop_read_data import synop_df
+import synop_read_data
+from synop_read_data import synop_df, decode_file
 from synop_download import download_and_save, url_timeseries
 
 
 
+# import datetime as dt
+# from synop_download import download_range
 # station = '04301'  # Kap Morris Jesup
-# for yr in [2004, 2002, 2000, 1998, 1996, 1994, 1992, 1990]:
-#     url, path = url_timeseries(yr-1, 1, 1, 0, yr, 12, 31, 23, station)
-#     download_and_save(path, url)
-#     time.sleep(360)  # seconds
+# paths = download_range(dt.datetime(1989, 1, 1), dt.datetime(2004, 12, 31, 23), station,
+#                        chunk_days=730, requests_per_minute=1/6)
 
 station = '01008'
 url, path = url_timeseries(2018,2,25,00,2018,3,1,16,station)
@@ -21,29 +23,66 @@ df_synop, df_climat = synop_df(path, timeseries=True)
 
 
 # WIP STARTS HERE
-def decode_multiple(path):
+def decode_multiple(path, max_memory=256, workers=None, overwrite=False):
     '''Decodes and saves multiple SYNOP files located in path.
 
+    Files whose decoded file is newer than both the raw file and the decoder
+    (synop_read_data.py) are skipped, so an interrupted run can be resumed.
+
     Arguments:
     ----------
-    path (contains all the *.csv files)
+    path (contains all the *.csv files, which may be compressed .csv.gz or
+    .csv.zst files)
+    max_memory = 256 (approximate memory ceiling per worker in MB, files are
+    decoded in chunks)
+    workers = None (number of processes, None uses all cores)
+    overwrite = False (decode all files again)
+
+    Returns:
+    --------
+    list of the files that failed to decode, the other files are decoded
+    regardless
 
     Examples:
     ---------
     path = '/home/sh16450/Documents/Synop_data/StationData/04301/'
-    decode_multiple(path)
+    failed = decode_multiple(path, workers=8)
 
     '''
-    list_files = sorted(glob.glob(os.path.join(path, '*.csv')))
-    print(list_files)
+    list_files = sorted(f for suffix in ['.csv', '.csv.gz', '.csv.zst']
+                        for f in glob.glob(os.path.join(path, '*' + suffix))
+                        if '_decoded.csv' not in f)
+    decoder_mtime = os.path.getmtime(synop_read_data.__file__)
+    jobs = []
     for f in list_files:
-        # WIP ENDS HERE
-        print('Working on {}!'.format(f))
-        df_synop, df_climat = synop_df(f, timeseries=True)
-        # Split the string before file extension to add 'decoded'
-        split_string = f.split('.')
-        path_save = split_string[0] + '_decoded.' + split_string[1]
-        df_synop.to_csv(path_save)
+        # Add 'decoded' before the file extension, compressed like the raw file
+        base, suffix = f.rsplit('.csv', 1)
+        path_save = base + '_decoded.csv' + suffix
+        if (not overwrite and os.path.exists(path_save) and
+                os.path.getmtime(path_save) >= max(os.path.getmtime(f), decoder_mtime)):
+            print('Skipping {}, already decoded.'.format(f))
+            continue
+        jobs.append((f, path_save))
+
+    start = time.time()
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(decode_file, f, path_save, max_memory): f
+                   for f, path_save in jobs}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                path_save, n_rows, seconds = future.result()
+            except Exception as e:
+                # A broken file must not stop the decoding of the others
+                print('[{}/{}] Could not decode {}: {!r}'.format(i, len(jobs), futures[future], e))
+                failed.append(futures[future])
+                continue
+            print('[{}/{}] Saved {} reports to {} in {:.1f} s.'
+                  .format(i, len(jobs), n_rows, path_save, seconds))
+    print('Decoded {} files in {:.1f} s.'.format(len(jobs) - len(failed), time.time() - start))
+    if failed:
+        print('Failed to decode {} files:\n{}'.format(len(failed), '\n'.join(sorted(failed))))
+    return sorted(failed)
 
 
 def open_multiple(path):
@@ -51,10 +90,13 @@ def open_multiple(path):
     path = '/home/sh16450/Documents/Synop_data/StationData/04301/'
     df = open_multiple(path)
     '''
-    all_files = sorted(glob.glob(os.path.join(path, "*decoded.csv")))
+    all_files = sorted(f for f in glob.glob(os.path.join(path, "*decoded.csv*"))
+                       if not f.endswith('.tmp'))
     df_from_each_file = (pd.read_csv(f) for f in all_files)
     df = pd.concat(df_from_each_file, ignore_index=True)
     df['time'] = pd.to_datetime(df.time)
+    # Overlapping files contain the same reports
+    df = df.drop_duplicates(['Station', 'time'], keep='last')
     df = df.set_index('time')
     return df
 
@@ -8,13 +8,17 @@ from siphon.simplewebservice.wyoming import WyomingUpperAir
 import seaborn as sns
 
 
-def plot_upper_air(station='11035', date=False):
+def plot_upper_air(station='11035', date=False, save=None):
     '''
     -----------------------------
     Default use of plot_upper_air:
 
     This will plot a SkewT sounding for station '11035' (Wien Hohe Warte)
     plot_upper_air(station='11035', date=False)
+
+    date = False (most recent sounding), True (asks for the date) or a
+    datetime (no prompt, e.g. for batch runs)
+    save = None (show the plot) or a file name to save the plot to
     '''
     # sns.set(rc={'axes.facecolor':'#343837', 'figure.facecolor':'#343837',
     #  'grid.linestyle':'','axes.labelcolor':'#04d8b2','text.color':'#04d8b2',
@@ -31,6 +35,9 @@ def plot_upper_air(station='11035', date=False):
         date = datetime(now.year, now.month, now.day, hour)
         datestr = date.strftime('%Hz %Y-%m-%d')
         print('{}'.format(date))
+    elif isinstance(date, datetime):
+        date = datetime(date.year, date.month, date.day, 0 if date.hour < 12 else 12)
+        datestr = date.strftime('%Hz %Y-%m-%d')
     else:
         year = int(input('Please specify the year: '))
         month = int(input('Please specify the month: '))
@@ -122,7 +129,11 @@ def plot_upper_air(station='11035', date=False):
     skew2.ax.set_xlim(-30, 10)
 
     # Show the plot
-    plt.show()
+    if save is None:
+        plt.show()
+    else:
+        fig.savefig(save, bbox_inches='tight')
+        plt.close(fig)
 
     return cape
 
@@ -0,0 +1,78 @@
+'''
+Benchmark of the import time of the modules.
+
+Every module is imported in a fresh interpreter several times and the median
+wall time is compared with its budget in BUDGET. Modules whose dependencies
+are not installed are skipped. The import of pandas and numpy alone is
+reported as well, as it is the floor of every module that needs them.
+
+Examples:
+---------
+python benchmarks/bench_import.py
+python benchmarks/bench_import.py --modules synop_read_data --repeat 10
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Import time budget per module in seconds
+BUDGET = {'synop_read_data': 0.5,
+          'synop_download': 0.5,
+          'SYNOP_no_bg': 3.0,
+          'METAR_pandas': 3.0}
+# Measured for reference only
+FLOOR = 'pandas, numpy'
+
+TIMER = '''
+import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+'''
+
+
+def import_time(module, repeat=5):
+    '''
+    Returns the median time to import module in a fresh interpreter, None if
+    a dependency of module is missing.
+    '''
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-W', 'ignore', '-c', TIMER.format(module)],
+                             cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        if out.returncode != 0:
+            if 'ModuleNotFoundError' in out.stderr:
+                return None
+            raise RuntimeError('import {} failed:\n{}'.format(module, out.stderr))
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modules', nargs='+', default=list(BUDGET), choices=list(BUDGET))
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module')
+    args = parser.parse_args()
+
+    print('{:<20} {:>10} {:>10}'.format('module', 'time (s)', 'budget'))
+    print('{:<20} {:>10}'.format(FLOOR, '{:.3f}'.format(import_time(FLOOR, args.repeat))))
+    over = []
+    for module in args.modules:
+        seconds = import_time(module, args.repeat)
+        if seconds is None:
+            print('{:<20} {:>10} (missing dependency)'.format(module, 'skipped'))
+            continue
+        flag = ' OVER BUDGET' if seconds > BUDGET[module] else ''
+        print('{:<20} {:>10.3f} {:>10.3f}{}'.format(module, seconds, BUDGET[module], flag))
+        if flag:
+            over.append(module)
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
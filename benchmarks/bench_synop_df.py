@@ -0,0 +1,158 @@
+'''
+Benchmark of synop_df on synthetic Ogimet files.
+
+Decodes seeded synthetic files (see synthetic_synop.py) in snapshot and
+timeseries mode and records the wall time, the peak RSS and the time spent
+per decoding stage. Every case runs in its own process, so the peak RSS is
+that of the case alone. With --compression the files are also decoded from
+gzip (.gz) or zstd (.zst) compressed copies and the compression ratio is
+reported. Results are compared against the stored baseline
+(benchmarks/baseline.json). The baseline holds the timings of one machine,
+so only runs on the same machine compare: record it with --save-baseline
+first, and again with every change that alters the decoding cost.
+
+Examples:
+---------
+python benchmarks/bench_synop_df.py
+python benchmarks/bench_synop_df.py --sizes 1000 100000
+python benchmarks/bench_synop_df.py --sizes 1000 100000 --save-baseline
+python benchmarks/bench_synop_df.py --sizes 100000 --compression gzip zstd
+'''
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'synop_bench')
+MODES = ['snapshot', 'timeseries']
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+# Slowdown against the baseline that is reported as a regression
+TOLERANCE = 1.1
+
+
+def run_case(path, mode):
+    '''Decodes path once and returns wall time, peak RSS and stage timings.'''
+    sys.path.insert(0, ROOT)
+    from synop_read_data import load_main, load_station_index, _decode
+    load_station_index()
+    timings = {}
+    start = time.perf_counter()
+    df = load_main(path)
+    timings['load'] = time.perf_counter() - start
+    final_df, df_climat = _decode(df, timeseries=(mode == 'timeseries'), timings=timings)
+    wall = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'wall': round(wall, 4), 'peak_rss_mb': round(peak_rss, 1), 'rows': len(final_df),
+            'stages': {k: round(v, 4) for k, v in timings.items()}}
+
+
+def input_file(n_reports, seed=0):
+    '''Returns the path of the synthetic file with n_reports, creating it if needed.'''
+    from synthetic_synop import write_synthetic_csv
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, 'synop_{}_seed{}.csv'.format(n_reports, seed))
+    if not os.path.exists(path):
+        print('Creating {}'.format(path))
+        write_synthetic_csv(path, n_reports, seed)
+    return path
+
+
+def compressed_file(path, method):
+    '''Returns a copy of path compressed with method and the compression ratio.'''
+    sys.path.insert(0, ROOT)
+    from synop_download import open_file
+    path_out = path + SUFFIXES[method]
+    if not os.path.exists(path_out):
+        with open(path, 'rb') as f_in, open_file(path_out, 'wb') as f_out:
+            for block in iter(lambda: f_in.read(2**20), b''):
+                f_out.write(block)
+    return path_out, os.path.getsize(path) / os.path.getsize(path_out)
+
+
+def compare(results, baseline):
+    '''Prints results next to the baseline and returns the names of regressed cases.'''
+    regressions = []
+    print('{:<20} {:>10} {:>10} {:>8} {:>12} {:>12}'.format(
+        'case', 'wall (s)', 'baseline', 'ratio', 'RSS (MB)', 'baseline'))
+    for case, res in results.items():
+        base = baseline.get(case)
+        if base is None:
+            print('{:<20} {:>10.3f} {:>10} {:>8} {:>12.0f} {:>12}'.format(
+                case, res['wall'], '-', '-', res['peak_rss_mb'], '-'))
+            continue
+        ratio = res['wall'] / base['wall']
+        flag = ' SLOWER' if ratio > TOLERANCE else ''
+        print('{:<20} {:>10.3f} {:>10.3f} {:>8.2f} {:>12.0f} {:>12.0f}{}'.format(
+            case, res['wall'], base['wall'], ratio, res['peak_rss_mb'],
+            base['peak_rss_mb'], flag))
+        if flag:
+            regressions.append(case)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--compression', nargs='+', default=[], choices=sorted(SUFFIXES),
+                        help='also decode compressed copies of the files')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--run', nargs=2, metavar=('PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # The station list is found relative to the repository
+    os.chdir(ROOT)
+
+    if args.run:
+        print(json.dumps(run_case(*args.run)))
+        return
+
+    results = {}
+    for n_reports in args.sizes:
+        path = input_file(n_reports)
+        inputs = [('', path, None)]
+        for method in args.compression:
+            path_compressed, ratio = compressed_file(path, method)
+            print('{} {}: compression ratio {:.1f}'.format(method, n_reports, ratio))
+            inputs.append(('_' + method, path_compressed, ratio))
+        for name, path_in, ratio in inputs:
+            for mode in args.modes:
+                out = subprocess.run([sys.executable, '-W', 'ignore', os.path.abspath(__file__),
+                                      '--run', path_in, mode],
+                                     check=True, stdout=subprocess.PIPE,
+                                     universal_newlines=True)
+                res = json.loads(out.stdout.strip().splitlines()[-1])
+                if ratio is not None:
+                    res['compression_ratio'] = round(ratio, 2)
+                results['{}_{}{}'.format(mode, n_reports, name)] = res
+                stages = ', '.join('{} {:.3f}'.format(k, v) for k, v in res['stages'].items())
+                print('{} {}{}: {:.3f} s, {:.0f} MB ({})'.format(
+                    mode, n_reports, name, res['wall'], res['peak_rss_mb'], stages))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print()
+    regressions = compare(results, baseline)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Saved the baseline to {}.'.format(args.baseline))
+    elif regressions:
+        print('Slower than the baseline. The baseline only compares runs on the same '
+              'machine, see --save-baseline.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Benchmark of the SYNOP section-1 group tokenizer used in synop_df.
+
+Compares the former nested startswith loop (one full column scan per
+indicator and column) with the single-pass _match_groups on a token frame
+of 100k reports.
+
+Examples:
+---------
+python benchmarks/bench_synop_tokenizer.py
+python benchmarks/bench_synop_tokenizer.py 250000
+'''
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synop_read_data import _match_groups  # noqa: E402
+
+
+def make_tokens(n_reports=100000, seed=0):
+    '''Returns a DataFrame of section-1 groups as created by str.split in synop_df.'''
+    rng = np.random.RandomState(seed)
+    groups = []
+    for x in range(1, 10):
+        body = rng.randint(0, 10000, n_reports)
+        col = np.char.add(str(x), np.char.zfill(body.astype(str), 4)).astype(object)
+        # Drop some groups and mark others as missing
+        col[rng.rand(n_reports) < 0.2] = None
+        col[rng.rand(n_reports) < 0.05] = str(x) + '////'
+        groups.append(col)
+    rows = [' '.join(g for g in row if g is not None) for row in zip(*groups)]
+    df = pd.Series(rows).str.split(' ', expand=True)
+    df.fillna(value='XXXXX', inplace=True)
+    return df
+
+
+def legacy_loop(df_new):
+    '''The nested loop synop_df used before the single-pass tokenizer.'''
+    df_new = df_new.copy()
+    list1 = ['X1', 'X2', 'X3', 'X4', 'X5', 'X6', 'X7', 'X8', 'X9']
+    max_iter = np.shape(df_new)[1]
+    for x in range(1, 10):
+        for y in range(0, max_iter):
+            if y == 0:
+                df_new[list1[x-1]] = df_new[y][df_new[y].str.startswith(str(x))]
+            else:
+                df_new[list1[x-1]][df_new[y].str.startswith(str(x))] = (
+                    df_new[y][df_new[y].str.startswith(str(x))])
+    return df_new[list1]
+
+
+def vectorized(df_new):
+    list1 = ['X1', 'X2', 'X3', 'X4', 'X5', 'X6', 'X7', 'X8', 'X9']
+    return _match_groups(df_new, list('123456789'), list1)
+
+
+def timeit(func, df, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == '__main__':
+    import warnings
+    warnings.simplefilter('ignore')
+    n_reports = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    df = make_tokens(n_reports)
+    t_old, res_old = timeit(legacy_loop, df)
+    t_new, res_new = timeit(vectorized, df)
+    pd.testing.assert_frame_equal(res_old, res_new)
+    print('{} reports, {} group columns'.format(n_reports, df.shape[1]))
+    print('nested loop: {:8.3f} s'.format(t_old))
+    print('single pass: {:8.3f} s'.format(t_new))
+    print('speedup:     {:8.1f}x'.format(t_old / t_new))
@@ -0,0 +1,124 @@
+'''
+Seeded generator of synthetic Ogimet SYNOP csv files.
+
+Every row is a valid AAXX report of a station in Input/station_latlon.csv
+with section 1 groups, and optionally 333 and 555 sections. Groups are left
+out or reported as missing ('/') at realistic rates, so the decoder sees the
+same kind of gaps as in live downloads.
+
+Examples:
+---------
+python benchmarks/synthetic_synop.py 100000 synop_100k.csv
+
+from synthetic_synop import write_synthetic_csv
+write_synthetic_csv('synop_100k.csv', 100000, seed=1)
+'''
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synop_read_data import load_station_index  # noqa: E402
+
+
+def _digits(rng, n, width, high=None):
+    '''Returns n zero padded random numbers below high as strings.'''
+    high = 10**width if high is None else high
+    return np.char.zfill(rng.randint(0, high, n).astype(str), width)
+
+
+def _group(rng, prefix, body, present=1.0, missing=0.0):
+    '''
+    Builds a column of groups prefix + body, '' where the group is not
+    reported and slashes where it is reported as missing.
+    '''
+    n = len(body)
+    groups = np.char.add(prefix, body).astype(object)
+    groups[rng.rand(n) < missing] = prefix + '/' * len(body[0])
+    groups[rng.rand(n) >= present] = ''
+    return groups
+
+
+def synthetic_reports(n_reports, seed=0, n_stations=3000, year=2018, month=2):
+    '''
+    Returns a DataFrame of synthetic reports in the Ogimet csv layout.
+
+    Arguments:
+    ----------
+    n_reports (number of rows)
+    seed = 0 (seed of the random numbers, the same seed gives the same file)
+    n_stations = 3000 (number of distinct stations)
+    year = 2018, month = 2 (date of the reports)
+
+    Returns:
+    --------
+    DataFrame with the columns ESTACION, ANO, MES, DIA, HORA, MINUTO, PARTE
+
+    '''
+    rng = np.random.RandomState(seed)
+    n = n_reports
+    wmo = load_station_index()['wmo']
+    stations = rng.choice(np.unique(wmo), n_stations, replace=False)
+    station = np.char.zfill(rng.choice(stations, n).astype(str), 5)
+    day = rng.randint(1, 29, n)
+    hour = rng.randint(0, 24, n)
+    # Wind in m/s (0, 1) or knots (3, 4)
+    iw = rng.choice(list('0134'), n)
+    dat = np.char.add(np.char.add(np.char.zfill(day.astype(str), 2),
+                                  np.char.zfill(hour.astype(str), 2)), iw)
+    iihvv = np.char.add(np.char.add(rng.choice(list('0134'), n), rng.choice(list('1237'), n)),
+                        np.char.add(rng.choice(list('0123456789/'), n), _digits(rng, n, 2)))
+    nddff = np.char.add(np.char.add(rng.choice(list('012345678/'), n), _digits(rng, n, 2, 37)),
+                        _digits(rng, n, 2, 60))
+    head = [np.full(n, 'AAXX', dtype=object), dat, station, iihvv, nddff]
+
+    def sign():
+        return rng.randint(0, 2, n).astype(str)
+
+    section1 = [
+        _group(rng, '1', np.char.add(sign(), _digits(rng, n, 3, 350)), 1.0, 0.05),
+        _group(rng, '2', np.char.add(sign(), _digits(rng, n, 3, 300)), 0.9, 0.05),
+        _group(rng, '3', np.char.add(rng.choice(list('09'), n), _digits(rng, n, 3)), 0.7),
+        _group(rng, '4', np.char.add(rng.choice(list('09'), n), _digits(rng, n, 3)), 0.9),
+        _group(rng, '5', np.char.add(_digits(rng, n, 1, 9), _digits(rng, n, 3, 80)), 0.7),
+        _group(rng, '6', np.char.add(_digits(rng, n, 3, 60), _digits(rng, n, 1)), 0.4),
+        _group(rng, '7', _digits(rng, n, 4), 0.6),
+        _group(rng, '8', _digits(rng, n, 4), 0.6),
+        _group(rng, '9', np.char.add(np.char.zfill(hour.astype(str), 2),
+                                     _digits(rng, n, 2, 60)), 0.3)]
+
+    section333 = [
+        _group(rng, '1', np.char.add(sign(), _digits(rng, n, 3, 350)), 0.3),
+        _group(rng, '2', np.char.add(sign(), _digits(rng, n, 3, 300)), 0.3),
+        _group(rng, '4', np.char.add(_digits(rng, n, 1), _digits(rng, n, 3, 200)), 0.2),
+        _group(rng, '55', _digits(rng, n, 3, 150), 0.1),
+        _group(rng, '6', np.char.add(_digits(rng, n, 3, 60), _digits(rng, n, 1)), 0.5, 0.05),
+        _group(rng, '7', _digits(rng, n, 4, 500), 0.3),
+        _group(rng, '8', _digits(rng, n, 4), 0.3),
+        _group(rng, '910', _digits(rng, n, 2, 40), 0.3),
+        _group(rng, '911', _digits(rng, n, 2, 50), 0.4)]
+    section555 = [_group(rng, '1', _digits(rng, n, 4), 0.1)]
+
+    def join(columns):
+        return [' '.join(g for g in row if g) for row in zip(*columns)]
+
+    reports = np.array(join(head + section1), dtype=object)
+    for marker, section in [(' 333 ', section333), (' 555 ', section555)]:
+        body = np.array(join(section), dtype=object)
+        has = body != ''
+        reports[has] = reports[has] + marker + body[has]
+    reports = reports + '='
+
+    return pd.DataFrame({'ESTACION': station, 'ANO': year, 'MES': month, 'DIA': day,
+                         'HORA': hour, 'MINUTO': 0, 'PARTE': reports})
+
+
+def write_synthetic_csv(path, n_reports, seed=0, n_stations=3000):
+    '''Writes synthetic_reports(n_reports, seed, n_stations) to path.'''
+    synthetic_reports(n_reports, seed, n_stations).to_csv(path, index=False)
+    return path
+
+
+if __name__ == '__main__':
+    write_synthetic_csv(sys.argv[2], int(sys.argv[1]))
@@ -0,0 +1,158 @@
+'''
+Access to the decoded METARs of the THREDDS data server (TDS).
+
+The NetCDF subset service (NCSS) returns the observations as a netCDF file of
+point features (CF discrete sampling geometries). The numeric variables are
+read as typed arrays and the character variables (station, weather, report)
+are decoded with one vectorized call per column.
+
+Examples:
+---------
+from metar_download import get_data, load_metar
+df = get_data(ncss, query)  # ncss, query from build_query (tds_catalog.get_ncss)
+df = load_metar('Surface_METAR_20171130_0000.nc')
+'''
+import io
+import random
+import re
+import time
+import numpy as np
+import pandas as pd
+
+# Catalog of the decoded METARs, its first dataset holds the latest reports
+METAR_CATALOG = 'http://thredds.ucar.edu/thredds/catalog/nws/metar/ncdecoded/catalog.xml'
+# Value of missing observations in the TDS output
+MISSING = -99999
+# Character variables that are renamed to the columns of the csv output
+RENAME = {'station_id': 'station'}
+_TIME_UNITS = {'seconds': 's', 'minutes': 'm', 'hours': 'h', 'days': 'D'}
+
+
+def _attr(var, name):
+    '''Attribute name of a netCDF variable as str (None if not set).'''
+    value = getattr(var, name, None)
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _column(var):
+    '''
+    Returns the values of a netCDF variable as a 1d array: character arrays
+    as str, numbers as float with missing values set to NaN, times as
+    datetime64.
+    '''
+    data = np.array(var[:])
+    if data.dtype.kind == 'S':
+        if data.ndim == 2:
+            # (n, strlen) single characters, viewed as one string per row
+            data = np.ascontiguousarray(data).view('S{}'.format(data.shape[1])).ravel()
+        return np.char.decode(np.char.strip(data), 'utf-8', 'replace').astype(object)
+    units = _attr(var, 'units') or ''
+    match = re.match(r'(\w+) since (.+)', units)
+    if match and match.group(1) in _TIME_UNITS:
+        origin = pd.Timestamp(match.group(2).replace('Z', '').strip())
+        return (origin.tz_localize(None) +
+                pd.to_timedelta(data.astype('float64'), unit=_TIME_UNITS[match.group(1)])).values
+    data = data.astype('float64')
+    for name in ['_FillValue', 'missing_value']:
+        value = _attr(var, name)
+        if value is not None:
+            data[np.isin(data, np.atleast_1d(value))] = np.nan
+    data[data == MISSING] = np.nan
+    return data
+
+
+def read_point_netcdf(source):
+    '''
+    Reads a netCDF file of point or station observations into a DataFrame
+    with one row per observation.
+
+    Station variables (latitude, longitude, station_id, ...) are repeated for
+    every observation of the station, using the index variable (indexed
+    ragged array) or the row sizes (contiguous ragged array) of the file.
+
+    Arguments:
+    ----------
+    source (path, bytes or file object of a netCDF3 file)
+
+    Returns:
+    --------
+    DataFrame with one column per variable
+
+    '''
+    from scipy.io import netcdf_file
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with netcdf_file(source, 'r', mmap=False) as nc:
+        variables = nc.variables
+        # The observation dimension is the one of the time variable
+        obs_dim = variables['time'].dimensions[0]
+        station_rows = None
+        for name, var in variables.items():
+            if _attr(var, 'instance_dimension') is not None:
+                station_rows = np.array(var[:]).astype(np.intp)
+            elif _attr(var, 'sample_dimension') is not None:
+                sizes = np.array(var[:]).astype(np.intp)
+                station_rows = np.repeat(np.arange(len(sizes)), sizes)
+        columns = {}
+        for name, var in variables.items():
+            if (not var.dimensions or _attr(var, 'instance_dimension') is not None or
+                    _attr(var, 'sample_dimension') is not None):
+                continue
+            values = _column(var)
+            if var.dimensions[0] != obs_dim:
+                if station_rows is None:
+                    continue
+                values = values[station_rows]
+            columns[RENAME.get(name, name)] = values
+    return pd.DataFrame(columns)
+
+
+def clean_metar(df):
+    '''
+    Drops the reports without wind or dew point and converts the cloud cover
+    to octas (10 if missing), as used by the station plots.
+    '''
+    df = df.replace(MISSING, np.nan)
+    df = df.dropna(how='any', subset=['wind_from_direction', 'wind_speed',
+                                      'dew_point_temperature'])
+    df['cloud_area_fraction'] = (df['cloud_area_fraction'] * 8)
+    df['cloud_area_fraction'] = df['cloud_area_fraction'].replace(np.nan, 10) \
+        .astype(int)
+    return df
+
+
+def get_data(ncss, query, retries=5, backoff=2):
+    '''
+    Requests the METARs of query as netCDF and returns them as a DataFrame.
+    Failed requests and unreadable responses are retried with exponential
+    backoff and jitter.
+
+    Arguments:
+    ----------
+    ncss (siphon NCSS of the METAR dataset, or any object with get_data_raw)
+    query (NCSS query, e.g. from build_query)
+    retries = 5 (number of retries)
+    backoff = 2 (base delay in seconds, doubled for every retry)
+
+    Returns:
+    --------
+    DataFrame of the reports, see clean_metar
+
+    '''
+    query.accept('netcdf')
+    for attempt in range(retries + 1):
+        try:
+            df = read_point_netcdf(ncss.get_data_raw(query))
+            break
+        except (IOError, ValueError, TypeError, KeyError) as e:
+            if attempt == retries:
+                raise IOError('Download of the METAR data failed: {}'.format(e))
+            delay = random.uniform(0, min(60, backoff * 2**attempt))
+            print('Download failed ({}), retrying in {:.1f} s.'.format(e, delay))
+            time.sleep(delay)
+    return clean_metar(df)
+
+
+def load_metar(path):
+    '''Reads a saved netCDF file of METARs (e.g. from the TDS file server).'''
+    return clean_metar(read_point_netcdf(path))
@@ -0,0 +1,370 @@
+'''
+Decoding of raw METAR reports into typed columns.
+
+All reports of a batch are decoded together: every group type (wind,
+visibility, weather, clouds, temperature, pressure) is found with one
+vectorized regular expression over the whole batch. The output follows
+synop_df: one row per report with Station and time, wind in knots,
+temperatures in degC, pressure in hPa and the station metadata if the
+station is in the METAR station index.
+
+Examples:
+---------
+from metar_read_data import metar_df, decode_reports
+df_metar = metar_df('metar_2018011412.txt', year=2018, month=1)
+# df_tds from metar_download.get_data, its station variables give the coordinates
+df_metar = decode_reports(df_tds['report'], stations=df_tds)
+'''
+import os
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from synop_read_data import MS_TO_KNOTS, KNOTS_TO_KPH, REJECT_COLUMNS
+
+METAR_STATION_CSV = './Input/metar_stations.csv'
+METAR_STATION_INDEX = './Input/metar_stations.npz'
+# String columns of the METAR station index (missing values are stored as '')
+METAR_STATION_TEXT = ['StationName', 'CountryCode']
+_metar_station_cache = {}
+
+# Number of cloud layers with their own columns
+CLOUD_LAYERS = 3
+# Cloud amount in octas (upper bound of the METAR class), 9 is sky obscured
+OCTAS = {'FEW': 2, 'SCT': 4, 'BKN': 7, 'OVC': 8, 'VV': 9}
+STATUTE_MILE = 1609.344
+INHG_TO_HPA = 33.8639
+
+# Groups are separated by single spaces, the text is padded with a space at both ends
+_HEADER = re.compile(r'^ (?:(?:METAR|SPECI) )?(?:COR )?([A-Z][A-Z0-9]{3}) '
+                     r'(\d{2})(\d{2})(\d{2})Z(?= )')
+# Trend and remarks are not decoded
+_TAIL = r' (?:RMK|NOSIG|BECMG|TEMPO)(?= ).*$'
+_WIND = r'(?<= )(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?(KT|MPS|KMH)(?= )'
+_VIS = r'(?<= )(\d{4})(?:NDV)?(?= )'
+_VIS_SM = r'(?<= )(?:(\d) )?M?(\d{1,2})(?:/(\d{1,2}))?SM(?= )'
+_PHENOMENA = 'DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS'
+_WEATHER = (r'(?<= )((?:[-+]|VC)?(?:(?:MI|PR|BC|DR|BL|SH|TS|FZ)(?:{0})*|(?:{0})+))(?= )'
+            .format(_PHENOMENA))
+_CLOUD = r'(?<= )(FEW|SCT|BKN|OVC|VV)(\d{3}|///)(?:CB|TCU|///)?(?= )'
+_CLEAR = r'(?<= )(?:CAVOK|SKC|CLR|NSC|NCD)(?= )'
+_TEMP = r'(?<= )(M?\d{2})/(M?\d{2}|//)?(?= )'
+_PRESSURE = r'(?<= )([QA])(\d{4})(?= )'
+# Optional time stamp (YYYYMMDDHHmm) in front of the reports of archive files
+_STAMP = r'^(\d{12}) +'
+
+# Weather strings that metpy's wx_code_map does not know, replaced before the lookup
+WX_ALIASES = {'-SG': 'SG', 'FZBR': 'FZFG', '-BLSN': 'BLSN', '-DRSN': 'DRSN', '-FZUP': 'FZDZ'}
+# WMO ww code of unknown weather strings (0: no symbol)
+WX_FALLBACK = 0
+# WMO ww code of every weather string seen so far (None if unknown)
+_wx_codes = {}
+
+
+def build_metar_station_index(csv_path=METAR_STATION_CSV, index_path=METAR_STATION_INDEX):
+    '''
+    Compiles the METAR station list into an .npz station index.
+
+    Arguments:
+    ----------
+    csv_path = METAR_STATION_CSV (station list with the columns ICAO,
+    StationName, CountryCode, latitude, longitude and Hp in decimal degrees and m)
+    index_path = METAR_STATION_INDEX (where to save the index)
+
+    Returns:
+    --------
+    dict of arrays: 'icao' (sorted ICAO ids), 'latitude', 'longitude', 'Hp',
+    the METAR_STATION_TEXT columns, 'csv_mtime'
+
+    '''
+    df = pd.read_csv(csv_path, usecols=['ICAO', 'StationName', 'CountryCode',
+                                        'latitude', 'longitude', 'Hp'])
+    df = df[df['ICAO'].str.fullmatch('[A-Z][A-Z0-9]{3}', na=False)]
+    df = df.drop_duplicates('ICAO').sort_values('ICAO')
+    index = {'icao': df['ICAO'].to_numpy(dtype='U4'),
+             'latitude': df['latitude'].to_numpy(dtype=float),
+             'longitude': df['longitude'].to_numpy(dtype=float),
+             'Hp': df['Hp'].to_numpy(dtype=float),
+             'csv_mtime': np.float64(os.path.getmtime(csv_path))}
+    for col in METAR_STATION_TEXT:
+        index[col] = df[col].fillna('').to_numpy(dtype=str)
+
+    try:
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        print('Could not save the station index to {}.'.format(index_path))
+    return index
+
+
+def load_metar_station_index(csv_path=METAR_STATION_CSV, index_path=METAR_STATION_INDEX):
+    '''
+    Returns the METAR station index, rebuilding it when the station list
+    changed, or None if there is no station list.
+    '''
+    if not os.path.exists(csv_path):
+        return None
+    csv_mtime = os.path.getmtime(csv_path)
+    cached = _metar_station_cache.get(index_path)
+    if cached is not None and cached['csv_mtime'] == csv_mtime:
+        return cached
+    index = None
+    if os.path.exists(index_path):
+        with np.load(index_path) as f:
+            if f['csv_mtime'] == csv_mtime:
+                index = {key: f[key] for key in f.files}
+    if index is None:
+        index = build_metar_station_index(csv_path, index_path)
+    _metar_station_cache[index_path] = index
+    return index
+
+
+def _metar_station_lookup(station, index):
+    '''Index row of every ICAO id in station (-1 if unknown).'''
+    icao = station.to_numpy(dtype='U4')
+    if len(index['icao']) == 0:
+        return np.full(len(icao), -1)
+    rows = np.searchsorted(index['icao'], icao)
+    rows = np.minimum(rows, len(index['icao']) - 1)
+    return np.where(index['icao'][rows] == icao, rows, -1)
+
+
+def _number(values):
+    '''Converts a Series of strings (M for minus) to float, NaN where missing.'''
+    return pd.to_numeric(values.str.replace('M', '-', regex=False),
+                         errors='coerce').astype(float)
+
+
+def _layers(matches, index):
+    '''Series per match number (0, 1, ...) of the extractall result matches.'''
+    number = matches.index.get_level_values('match')
+    return [matches[number == i].droplevel('match').reindex(index)
+            for i in range(CLOUD_LAYERS)]
+
+
+def _wx_code(text):
+    '''WMO ww code of the first weather group of text (None if unknown).'''
+    if text not in _wx_codes:
+        from metpy.plots.wx_symbols import wx_code_map
+        group = text
+        for old, new in WX_ALIASES.items():
+            group = group.replace(old, new)
+        # Only the first group is plotted if there are multiple
+        group = group.split()[0] if ' ' in group else group
+        _wx_codes[text] = wx_code_map.get(group)
+    return _wx_codes[text]
+
+
+def weather_codes(weather, fallback=WX_FALLBACK):
+    '''
+    Maps METAR weather strings to WMO ww codes for the present weather
+    symbols. Every distinct string is looked up once (and remembered for
+    later calls), so large batches cost one lookup per distinct string.
+
+    Arguments:
+    ----------
+    weather (Series or list of weather strings, e.g. '-RA BR', missing
+    values are no weather)
+    fallback = WX_FALLBACK (code of strings that are not known)
+
+    Returns:
+    --------
+    int array of WMO ww codes
+
+    Examples:
+    ---------
+    from metar_read_data import weather_codes
+    wx = weather_codes(df['weather'])
+    stationplot.plot_symbol('W', wx, current_weather)
+
+    '''
+    weather = pd.Categorical(pd.Series(weather, dtype=object).fillna('').to_numpy())
+    codes = [_wx_code(text) for text in weather.categories]
+    lookup = np.array([fallback if code is None else code for code in codes] + [fallback],
+                      dtype=int)
+    return lookup[weather.codes]
+
+
+def load_reports(path):
+    '''
+    Reads a flat file of METARs, one report per line. A report may be
+    preceded by its time stamp (YYYYMMDDHHmm), as in Ogimet archives.
+
+    Returns:
+    --------
+    DataFrame with the columns 'report' and 'stamp' (NaT without time stamp)
+
+    '''
+    from synop_download import open_file
+    with open_file(path, 'rt') as f:
+        lines = pd.Series(f.read().splitlines(), dtype=object)
+    lines = lines[lines.str.strip() != ''].reset_index(drop=True)
+    stamp = pd.to_datetime(lines.str.extract(_STAMP, expand=False), format='%Y%m%d%H%M',
+                           errors='coerce')
+    return pd.DataFrame({'report': lines.str.replace(_STAMP, '', regex=True), 'stamp': stamp})
+
+
+def metar_df(path, year=None, month=None, rejects=None, stations=None):
+    '''
+    Decodes a flat file of METARs (see load_reports).
+
+    Arguments:
+    ----------
+    path (text file, compressed if it ends in .gz or .zst)
+    year = None, month = None (of the reports without time stamp, default
+    the current month)
+    rejects = None (list, the rejected reports are appended as a DataFrame)
+    stations = None (station coordinates, see decode_reports)
+
+    Returns:
+    --------
+    DataFrame of the decoded reports (see decode_reports)
+
+    Examples:
+    ---------
+    from metar_read_data import metar_df
+    df_metar = metar_df('metar_2018011412.txt', 2018, 1)
+
+    '''
+    df = load_reports(path)
+    return decode_reports(df['report'], year, month, rejects, stamp=df['stamp'],
+                          stations=stations)
+
+
+def decode_reports(reports, year=None, month=None, rejects=None, stamp=None, stations=None):
+    '''
+    Decodes raw METAR reports in one vectorized pass.
+
+    Arguments:
+    ----------
+    reports (Series of report strings, e.g. 'METAR LOWW 141220Z 09006KT 9999
+    -RA FEW030 BKN050 08/05 Q1013 NOSIG=')
+    year = None, month = None (of the reports, default the current month;
+    reports of a later day than today are taken from the month before)
+    rejects = None (list, the rejected reports are appended as a DataFrame)
+    stamp = None (Series of time stamps of the reports, their year and
+    month are used where given)
+    stations = None (DataFrame with the columns station, latitude, longitude
+    and optionally altitude, e.g. from metar_download.get_data or load_metar.
+    Fills the coordinates of the stations that are not in the METAR station
+    index)
+
+    Returns:
+    --------
+    DataFrame with the columns Station (ICAO id), time, dd (deg, NaN if
+    variable), ff and ff_gust (knots), vis (m), weather (e.g. '-RA BR'),
+    cloud_cover (octas, 9 sky obscured), cloud_amount_<i> (octas) and
+    cloud_base_<i> (ft) of the first CLOUD_LAYERS layers, TT and TD (degC),
+    QNH (hPa), latitude, longitude and Hp (NaN for unknown stations) and,
+    for stations in the METAR station index, StationName and CountryCode
+
+    '''
+    reports = pd.Series(reports, dtype=object).reset_index(drop=True)
+    text = reports.fillna('').astype(str)
+    text = ' ' + text.str.replace(r'[\s=]+', ' ', regex=True).str.strip() + ' '
+    header = text.str.extract(_HEADER)
+    valid = header[0].notnull()
+    now = datetime.utcnow()
+    if stamp is None:
+        stamp = pd.Series(pd.NaT, index=reports.index)
+    stamp = pd.Series(pd.to_datetime(stamp), dtype='datetime64[ns]').reset_index(drop=True)
+    day = pd.to_numeric(header[1], errors='coerce')
+    if year is None and month is None:
+        # Reports of a later day are from the previous month
+        first = pd.Timestamp(now.year, now.month, 1)
+        base = pd.Series(np.where(day > now.day, first - pd.DateOffset(months=1), first),
+                         index=reports.index)
+    else:
+        base = pd.Series(pd.Timestamp(year or now.year, month or now.month, 1),
+                         index=reports.index)
+    base = base.where(stamp.isnull(), stamp.dt.to_period('M').dt.start_time)
+    time = pd.to_datetime({'year': base.dt.year, 'month': base.dt.month, 'day': day,
+                           'hour': pd.to_numeric(header[2], errors='coerce'),
+                           'minute': pd.to_numeric(header[3], errors='coerce')},
+                          errors='coerce')
+    bad = ~valid | time.isnull()
+    rejected = pd.DataFrame({'Station': header[0][bad], 'time': time[bad],
+                             'fields': 'Station, time', 'group': reports[bad],
+                             'reason': np.where(valid[bad], 'invalid date', 'no header')},
+                            columns=REJECT_COLUMNS)
+    if len(rejected):
+        print('Rejected {} malformed reports.'.format(len(rejected)))
+    if rejects is not None:
+        rejects.append(rejected.reset_index(drop=True))
+    text = text[~bad]
+    # The groups after the header and before the trend and remarks
+    body = (text.str.replace(_HEADER, ' ', regex=True)
+            .str.replace(_TAIL, ' ', regex=True))
+
+    final_df = pd.DataFrame(index=body.index)
+    final_df['Station'] = header[0][~bad]
+    final_df['time'] = time[~bad]
+
+    # Wind, converted to knots
+    wind = body.str.extract(_WIND)
+    to_knots = wind[3].map({'KT': 1, 'MPS': MS_TO_KNOTS, 'KMH': 1 / KNOTS_TO_KPH})
+    final_df['dd'] = pd.to_numeric(wind[0], errors='coerce').astype(float)
+    final_df['ff'] = pd.to_numeric(wind[1]) * to_knots
+    final_df['ff_gust'] = pd.to_numeric(wind[2]) * to_knots
+
+    # Visibility in m, 9999 and CAVOK are 10 km or more
+    vis = pd.to_numeric(body.str.extract(_VIS, expand=False))
+    miles = body.str.extract(_VIS_SM).apply(pd.to_numeric)
+    miles = np.where(miles[2].notnull(), miles[0].fillna(0) + miles[1] / miles[2], miles[1])
+    vis = vis.fillna(pd.Series(miles * STATUTE_MILE, index=body.index).round())
+    cavok = body.str.contains(' CAVOK ', regex=False)
+    final_df['vis'] = vis.mask(cavok | (vis == 9999), 10000)
+
+    # Present weather groups, joined as in the TDS weather column
+    weather = body.str.findall(_WEATHER).str.join(' ')
+    final_df['weather'] = weather.mask(weather == '')
+
+    # Cloud layers and total cover
+    clouds = body.str.extractall(_CLOUD)
+    amount = clouds[0].map(OCTAS)
+    base = pd.to_numeric(clouds[1], errors='coerce') * 100
+    cover = amount.groupby(level=0).max().reindex(body.index)
+    final_df['cloud_cover'] = cover.mask(cover.isnull() & body.str.contains(_CLEAR), 0)
+    for i, (layer_amount, layer_base) in enumerate(zip(_layers(amount, body.index),
+                                                       _layers(base, body.index)), 1):
+        final_df['cloud_amount_' + str(i)] = layer_amount
+        final_df['cloud_base_' + str(i)] = layer_base
+
+    # Temperature and dew point
+    temp = body.str.extract(_TEMP)
+    final_df['TT'] = _number(temp[0])
+    final_df['TD'] = _number(temp[1])
+
+    # QNH in hPa, or the altimeter setting in inches of mercury
+    pressure = body.str.extract(_PRESSURE)
+    value = pd.to_numeric(pressure[1])
+    final_df['QNH'] = np.where(pressure[0] == 'A', (value / 100 * INHG_TO_HPA).round(1),
+                               value)
+
+    # Add the station metadata if there is a station list
+    index = load_metar_station_index()
+    if index is not None:
+        rows = _metar_station_lookup(final_df['Station'], index)
+        known = rows >= 0
+        for col in METAR_STATION_TEXT + ['latitude', 'longitude', 'Hp']:
+            values = index[col][rows]
+            if col in METAR_STATION_TEXT:
+                values = np.where(known & (values != ''), values, None)
+            else:
+                values = np.where(known, values, np.nan)
+            final_df[col] = values
+    else:
+        for col in ['latitude', 'longitude', 'Hp']:
+            final_df[col] = np.nan
+    # Coordinates of the other stations from the station variables of the TDS
+    if stations is not None:
+        coords = (stations.dropna(subset=['latitude', 'longitude'])
+                  .drop_duplicates('station').set_index('station'))
+        for col, source in [('latitude', 'latitude'), ('longitude', 'longitude'),
+                            ('Hp', 'altitude')]:
+            if source in coords.columns:
+                final_df[col] = final_df[col].fillna(
+                    final_df['Station'].map(coords[source]).astype(float))
+    return final_df.reset_index(drop=True)
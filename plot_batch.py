@@ -0,0 +1,141 @@
+'''
+Non-interactive plotting of many products in one process.
+
+The heavy imports (cartopy, metpy, siphon, matplotlib), the station index,
+the map projections and the map features are loaded once and reused for all
+jobs. SYNOP maps of the same hour share one download and one decode.
+
+Jobs are given either on the command line (every product for every date)
+or in a job file with one job per line: product, date (YYYYMMDDHH) and
+optionally the areas (synop) or stations (upper_air), e.g.
+
+    synop 2018011712 AT UK
+    upper_air 2018011712 11035 11010
+
+Examples:
+---------
+python plot_batch.py --start 2018010100 --end 2018013123 --areas AT EU
+python plot_batch.py --dates 2018011712 --products synop upper_air
+python plot_batch.py --jobs jobs.txt --path /tmp/maps
+'''
+import argparse
+from datetime import datetime, timedelta
+from os.path import expanduser
+import os
+import sys
+import time
+import matplotlib
+# No display needed, plots are only saved
+matplotlib.use('Agg')
+
+PRODUCTS = ['synop', 'upper_air']
+DEFAULT_STATIONS = ['11035']
+
+
+def parse_date(text):
+    '''Parses YYYYMMDDHH to a datetime.'''
+    return datetime.strptime(text, '%Y%m%d%H')
+
+
+def read_jobs(filename):
+    '''Returns the (product, date, targets) jobs of a job file.'''
+    jobs = []
+    with open(filename) as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if fields[0] not in PRODUCTS:
+                raise ValueError('Unknown product {} in {}'.format(fields[0], filename))
+            jobs.append((fields[0], parse_date(fields[1]), fields[2:]))
+    return jobs
+
+
+def hourly(start, end, step=1):
+    '''Returns the dates from start to end (inclusive) every step hours.'''
+    dates = []
+    while start <= end:
+        dates.append(start)
+        start += timedelta(hours=step)
+    return dates
+
+
+def run_synop(date, areas, path):
+    '''Downloads, decodes and plots the SYNOP maps of one hour.'''
+    from synop_download import url_any_hour, download_and_save
+    from synop_read_data import synop_df
+    from SYNOP_no_bg import AREAS, plot_area
+    url, path_data = url_any_hour(date.year, date.month, date.day, date.hour)
+    download_and_save(path_data, url)
+    df_synop, df_climat = synop_df(path_data)
+    for area in areas or list(AREAS):
+        plot_area(df_synop, area, path=path,
+                  filename='SYNOP_{}_{}.png'.format(area, date.strftime('%Y%m%d%H')))
+
+
+def run_upper_air(date, stations, path):
+    '''Plots the soundings of the stations closest to date (00z or 12z).'''
+    from UPPER_AIR import plot_upper_air
+    for station in stations or DEFAULT_STATIONS:
+        plot_upper_air(station, date, save=os.path.join(
+            path, 'SKEWT_{}_{}.png'.format(station, date.strftime('%Y%m%d%H'))))
+
+
+def run_jobs(jobs, path):
+    '''Runs all jobs and returns the jobs that failed.'''
+    os.makedirs(path, exist_ok=True)
+    run = {'synop': run_synop, 'upper_air': run_upper_air}
+    failed = []
+    start = time.time()
+    for i, (product, date, targets) in enumerate(jobs, 1):
+        job_start = time.time()
+        # One broken hour does not stop the batch
+        try:
+            run[product](date, targets, path)
+        except Exception as e:
+            print('[{}/{}] {} {} failed: {}'.format(i, len(jobs), product, date, e))
+            failed.append((product, date, targets))
+            continue
+        print('[{}/{}] {} {} done in {:.1f} s.'.format(i, len(jobs), product, date,
+                                                       time.time() - job_start))
+    print('Ran {} jobs in {:.1f} s, {} failed.'.format(len(jobs), time.time() - start,
+                                                        len(failed)))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--jobs', help='job file, one "product date [targets]" per line')
+    parser.add_argument('--dates', nargs='+', type=parse_date, default=[],
+                        help='dates as YYYYMMDDHH')
+    parser.add_argument('--start', type=parse_date, help='first date (YYYYMMDDHH)')
+    parser.add_argument('--end', type=parse_date, help='last date (YYYYMMDDHH)')
+    parser.add_argument('--step', type=int, default=1, help='hours between start and end')
+    parser.add_argument('--products', nargs='+', default=['synop'], choices=PRODUCTS)
+    parser.add_argument('--areas', nargs='+', default=[], help='SYNOP areas, default all')
+    parser.add_argument('--stations', nargs='+', default=DEFAULT_STATIONS,
+                        help='upper air stations')
+    parser.add_argument('--path', default=expanduser('~') + '/Documents/Metar_plots',
+                        help='directory of the plots')
+    args = parser.parse_args()
+
+    jobs = read_jobs(args.jobs) if args.jobs else []
+    dates = list(args.dates)
+    if args.start is not None:
+        dates += hourly(args.start, args.end or args.start, args.step)
+    targets = {'synop': args.areas, 'upper_air': args.stations}
+    jobs += [(product, date, targets[product]) for date in dates for product in args.products]
+    # Soundings are at 00z and 12z, every one is plotted once
+    jobs = [(product, date.replace(hour=0 if date.hour < 12 else 12), job_targets)
+            if product == 'upper_air' else (product, date, job_targets)
+            for product, date, job_targets in jobs]
+    jobs = list(dict((job[:2] + (tuple(job[2]),), job) for job in jobs).values())
+    if not jobs:
+        parser.error('no jobs, give --jobs, --dates or --start')
+    failed = run_jobs(jobs, args.path)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
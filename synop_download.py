@@ -1,23 +1,52 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import glob
+import gzip
+import io
+import json
+import random
+import re
+import threading
+import time
 import urllib3
 import os
 from os.path import expanduser
 import pandas as pd
-import shutil
 
-
-
-def url_synop(lang='eng', header='yes'):
-    begin = str(input('Please enter the start time of the query of the format'
-                      '(YYYYMMDDHHmm): '))
-    end = str(input('Please enter the end time of the query of the format'
-                    '(YYYYMMDDHHmm). If you enter "N" then it will use current'
-                    'time as the end time: '))
+OGIMET_URL = 'http://www.ogimet.com/cgi-bin/getsynop?'
+# Columns every Ogimet getsynop csv starts with
+OGIMET_FIELDS = [b'ESTACION', b'ANO', b'MES', b'DIA', b'HORA', b'MINUTO', b'PARTE']
+# Saved instead of an empty response (no reports in the period)
+EMPTY_CSV = b','.join(OGIMET_FIELDS) + b'\n'
+# Columns that identify a report, (station, time)
+REPORT_KEY = ['ESTACION', 'ANO', 'MES', 'DIA', 'HORA', 'MINUTO']
+
+# Extension of the saved files, '.csv.gz' or '.csv.zst' stores them compressed
+RAW_SUFFIX = '.csv'
+# Compression level of .gz (1-9) and .zst (1-22) files
+COMPRESSION_LEVEL = {'gzip': 6, 'zstd': 9}
+
+# One client for all downloads, connections are kept alive and reused. Failed
+# requests are retried by fetch (with backoff), only redirects are followed here
+http = urllib3.PoolManager(maxsize=8, timeout=urllib3.Timeout(connect=10, read=120),
+                           retries=urllib3.Retry(total=None, connect=0, read=0, status=0,
+                                                 other=0, redirect=5))
+
+
+def url_synop(lang='eng', header='yes', begin=None, end=None, state=None):
+    # Only asks for the values that are not given
+    if begin is None:
+        begin = str(input('Please enter the start time of the query of the format'
+                          '(YYYYMMDDHHmm): '))
+    if end is None:
+        end = str(input('Please enter the end time of the query of the format'
+                        '(YYYYMMDDHHmm). If you enter "N" then it will use current'
+                        'time as the end time: '))
     # state='Austri' for Austrian stations
-    state = str(input('If you want to download synops from a specific country'
-                      'only then please specify the three letter acronym'
-                      '(e.g. "Pol"). If no country enter "N": '))
+    if state is None:
+        state = str(input('If you want to download synops from a specific country'
+                          'only then please specify the three letter acronym'
+                          '(e.g. "Pol"). If no country enter "N": '))
     list_names = ['begin', 'end', 'lang', 'header', 'state']
     lis = [x for x in [begin, end, lang, header, state]]
     dic = {}
@@ -26,7 +55,7 @@ def url_synop(lang='eng', header='yes'):
             pass
         else:
             dic[name] = val
-    url = 'http://www.ogimet.com/cgi-bin/getsynop?'
+    url = OGIMET_URL
     i = 0
     for key, value in dic.items():
         # print(key)
@@ -68,20 +97,18 @@ def url_last_hour(state=None, lang='eng', header='yes'):
     end_str = now.strftime('%Y%m%d%H%M')
     save_str = datetime(now.year, now.month, now.day, now.hour, 00)
     save_str = save_str.strftime('%Y%m%d%H%M')
-    start = datetime(now.year, now.month, now.day, now.hour-1, 31)
+    start = datetime(now.year, now.month, now.day, now.hour) - timedelta(minutes=29)
     start_str = start.strftime('%Y%m%d%H%M')
     # set up the paths and test for existence
     path = expanduser('~') + '/Documents/Synop_data'
-    try:
-        os.listdir(path)
-    except FileNotFoundError:
-        os.mkdir(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
         print('Created the path {}'.format(path))
 
     if state is None:
-        path = path + '/synop_' + save_str + '.csv'
+        path = path + '/synop_' + save_str + RAW_SUFFIX
     else:
-        path = path + '/synop_' + save_str + '_' + state + '.csv'
+        path = path + '/synop_' + save_str + '_' + state + RAW_SUFFIX
 
     list_names = ['begin', 'end', 'lang', 'header', 'state']
     lis = [x for x in [start_str, end_str, lang, header, state]]
@@ -91,7 +118,7 @@ def url_last_hour(state=None, lang='eng', header='yes'):
             pass
         else:
             dic[name] = val
-    url = 'http://www.ogimet.com/cgi-bin/getsynop?'
+    url = OGIMET_URL
     i = 0
     for key, value in dic.items():
         # print(key)
@@ -134,20 +161,18 @@ def url_any_hour(year=None, month=None, day=None, hour=None, state=None, lang='e
     end_str = now.strftime('%Y%m%d%H%M')
     save_str = datetime(year, month, day, hour, 00)
     save_str = save_str.strftime('%Y%m%d%H%M')
-    start = datetime(year, month, day, hour-1, 31)
+    start = datetime(year, month, day, hour) - timedelta(minutes=29)
     start_str = start.strftime('%Y%m%d%H%M')
     # set up the paths and test for existence
     path = expanduser('~') + '/Documents/Synop_data'
-    try:
-        os.listdir(path)
-    except FileNotFoundError:
-        os.mkdir(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
         print('Created the path {}'.format(path))
 
     if state is None:
-        path = path + '/synop_' + save_str + '.csv'
+        path = path + '/synop_' + save_str + RAW_SUFFIX
     else:
-        path = path + '/synop_' + save_str + '_' + state + '.csv'
+        path = path + '/synop_' + save_str + '_' + state + RAW_SUFFIX
 
     list_names = ['begin', 'end', 'lang', 'header', 'state']
     lis = [x for x in [start_str, end_str, lang, header, state]]
@@ -157,7 +182,7 @@ def url_any_hour(year=None, month=None, day=None, hour=None, state=None, lang='e
             pass
         else:
             dic[name] = val
-    url = 'http://www.ogimet.com/cgi-bin/getsynop?'
+    url = OGIMET_URL
     i = 0
     for key, value in dic.items():
         # print(key)
@@ -214,14 +239,12 @@ def url_timeseries(year=None, month=None, day=None, hour=None,
     save_str = save_str.strftime('%Y%m%d%H%M')
     # set up the paths and test for existence
     path = expanduser('~') + '/Documents/Synop_data/StationData/' + station + '/'
-    try:
-        os.listdir(path)
-    except FileNotFoundError:
+    if not os.path.isdir(path):
         os.makedirs(path)
         print('Created the path {}'.format(path))
 
     # Where to save the file
-    path = path + 'synop_' + station + '_' + save_str + '-' + save_str_end + '.csv'
+    path = path + 'synop_' + station + '_' + save_str + '-' + save_str_end + RAW_SUFFIX
 
     list_names = ['block', 'begin', 'end', 'lang', 'header', 'state']
     lis = [x for x in [station, start_str, end_str, lang, header, state]]
@@ -231,7 +254,7 @@ def url_timeseries(year=None, month=None, day=None, hour=None,
             pass
         else:
             dic[name] = val
-    url = 'http://www.ogimet.com/cgi-bin/getsynop?'
+    url = OGIMET_URL
     i = 0
     for key, value in dic.items():
         # print(key)
@@ -247,15 +270,35 @@ def url_timeseries(year=None, month=None, day=None, hour=None,
     return url, path
 
 
-def download_and_save(path, url):
+# Raw downloads and the index of the managed cache
+RAW_CACHE = expanduser('~') + '/Documents/Synop_data'
+RAW_CACHE_INDEX = RAW_CACHE + '/raw_index.json'
+# Maximum total size of the raw files in the index in bytes
+RAW_CACHE_SIZE = 2**32
+# Periods ending more than SETTLE_TIME ago are final, later reports are not
+# expected any more. Younger files are fetched again after REFRESH_TIME.
+SETTLE_TIME = timedelta(hours=3)
+REFRESH_TIME = timedelta(minutes=10)
+_raw_index_lock = threading.Lock()
+
+
+def download_and_save(path, url, settle=SETTLE_TIME, refresh=REFRESH_TIME):
     '''
     Function to download and save the file from the url created by either
-    url_last_hour() or url_synop().
+    url_last_hour() or url_synop(). Files are kept in a managed cache: a file
+    whose period ended more than settle ago is never downloaded again, a more
+    recent one (e.g. the current hour) is fetched again once it is older than
+    refresh, so late reports are picked up. The least recently used files are
+    removed when the cache is larger than RAW_CACHE_SIZE.
 
     Arguments:
     ----------
     path (where to save file on disk)
     url (to download file)
+    settle = SETTLE_TIME (time after the end of the period after which the
+    file is final)
+    refresh = REFRESH_TIME (age after which a file that is not final is
+    fetched again)
 
     Returns:
     --------
@@ -268,15 +311,656 @@ def download_and_save(path, url):
     download_and_save(path, url)
 
     '''
-
-    if os.path.exists(path):
+    path = os.path.abspath(path)
+    now = datetime.utcnow()
+    entry, fresh = _raw_cache_lookup(path, url, settle, refresh, now)
+    if fresh:
         print('Using an existing file stored in {}.'.format(path))
+        _touch_raw_cache(path, entry, now)
+        return
+    try:
+        # No reports in the period is a valid answer, not a failed download
+        data = fetch(url, allow_empty=True)
+    except IOError as e:
+        if entry is None:
+            raise
+        # Keep serving the older file rather than failing
+        print('{}, using the existing file stored in {}.'.format(e, path))
+        return
+    if not data.strip():
+        # Saved with the header only, so the file reads as a csv without rows
+        data = EMPTY_CSV
+    unchanged = False
+    if entry is not None:
+        with open_file(path) as f:
+            unchanged = f.read() == data
+    if unchanged:
+        # Keep the mtime, so decoded results of the file stay valid
+        print('No new reports, using the existing file stored in {}.'.format(path))
     else:
-        http = urllib3.PoolManager()
-        with http.request('GET', url, preload_content=False) as r, open(path, 'wb') \
-                as out_file:
-                    shutil.copyfileobj(r, out_file)
+        # Only complete and valid files end up at path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open_file(path + '.tmp', 'wb', compression(path)) as out_file:
+            out_file.write(data)
+        os.replace(path + '.tmp', path)
         print('Saved file to {}.'.format(path))
+    _touch_raw_cache(path, {'fetched': now.isoformat(), 'size': os.path.getsize(path)}, now)
+
+
+def compression(path):
+    '''Returns the compression of path from its extension: 'gzip', 'zstd' or None.'''
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def open_file(path, mode='rb', method='infer'):
+    '''
+    Opens a file that is (de)compressed on the fly if it ends in .gz or .zst,
+    with the level of COMPRESSION_LEVEL. zstd needs the zstandard package.
+
+    Arguments:
+    ----------
+    path (file to open)
+    mode = 'rb' ('rb', 'wb', 'rt' or 'wt')
+    method = 'infer' (compression, 'gzip', 'zstd' or None, by default from
+    the extension of path)
+
+    Returns:
+    --------
+    file object
+
+    Examples:
+    ---------
+    from synop_download import open_file
+    with open_file('synop_201802011200.csv.zst', 'rt') as f:
+        header = f.readline()
+
+    '''
+    if method == 'infer':
+        method = compression(path)
+    if method == 'gzip':
+        return gzip.open(path, mode, compresslevel=COMPRESSION_LEVEL['gzip'])
+    if method != 'zstd':
+        return open(path, mode)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading and writing .zst files needs the zstandard package')
+    if mode.startswith('r'):
+        f = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        f = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL['zstd']).stream_writer(
+            open(path, 'wb'), closefd=True)
+    if mode.endswith('t'):
+        return io.TextIOWrapper(f)
+    return f
+
+
+def _raw_cache_lookup(path, url, settle, refresh, now):
+    '''
+    Returns the index entry of path (None if there is no file) and whether the
+    file can be used without downloading it again.
+    '''
+    with _raw_index_lock:
+        index = _load_raw_index()
+    entry = index.get(path)
+    if entry is not None and not os.path.exists(path):
+        entry = None
+    if entry is None and os.path.exists(path):
+        # Files from before the index are treated as fetched at their mtime
+        entry = {'fetched': datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat()}
+    if entry is None:
+        return None, False
+    fetched = datetime.strptime(entry['fetched'][:19], '%Y-%m-%dT%H:%M:%S')
+    end = _period_end(url)
+    final = end is None or fetched - end > settle
+    return entry, final or now - fetched < refresh
+
+
+def _period_end(url):
+    '''Returns the end of the period requested by an Ogimet url, None if open ended.'''
+    end = re.search(r'[?&]end=(\d{12})', url)
+    if end is None:
+        return None
+    return datetime.strptime(end.group(1), '%Y%m%d%H%M')
+
+
+# Names of raw downloads: synop_<time>[_<state>] of url_last_hour/url_any_hour and
+# synop_<station>_<begin>-<end> of url_timeseries. Station stores (synop_<station>)
+# and decoded files (*_decoded.csv) are derived products and never evicted.
+_RAW_NAME = re.compile(r'^synop_(?!.*_decoded\.)(?:\d{12}(?:_[A-Za-z]+)?|\w+?_\d{12}-\d{12})'
+                       r'\.csv(?:\.gz|\.zst)?$')
+
+
+def _is_raw_file(path):
+    '''True if path is a raw download that the cache may remove.'''
+    return _RAW_NAME.match(os.path.basename(path)) is not None
+
+
+def _load_raw_index():
+    '''Reads the index of the raw cache, rebuilding it if it is missing.'''
+    try:
+        with open(RAW_CACHE_INDEX) as f:
+            index = json.load(f)
+        # Indexes written before derived files were excluded may list them
+        return {key: entry for key, entry in index.items() if _is_raw_file(key)}
+    except (OSError, ValueError):
+        pass
+    # One scan of the cache directory, after that the index is used
+    index = {}
+    entries = [entry for suffix in ['.csv', '.csv.gz', '.csv.zst'] for entry in
+               glob.glob(os.path.join(RAW_CACHE, '**', 'synop_*' + suffix), recursive=True)
+               if _is_raw_file(entry)]
+    for entry in entries:
+        mtime = datetime.utcfromtimestamp(os.path.getmtime(entry)).isoformat()
+        index[os.path.abspath(entry)] = {'fetched': mtime, 'used': mtime,
+                                         'size': os.path.getsize(entry)}
+    return index
+
+
+def _touch_raw_cache(path, entry, now):
+    '''
+    Records path as used at now in the index and evicts the least recently
+    used files beyond RAW_CACHE_SIZE.
+    '''
+    entry = dict(entry, used=now.isoformat())
+    entry.setdefault('size', os.path.getsize(path))
+    try:
+        with _raw_index_lock:
+            index = _load_raw_index()
+            index[path] = entry
+            total = 0
+            for key in sorted(index, key=lambda k: index[k]['used'], reverse=True):
+                if total + index[key]['size'] > RAW_CACHE_SIZE and key != path:
+                    if os.path.exists(key):
+                        os.remove(key)
+                    del index[key]
+                else:
+                    total += index[key]['size']
+            os.makedirs(RAW_CACHE, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(RAW_CACHE_INDEX, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, RAW_CACHE_INDEX)
+    except OSError:
+        print('Could not update the cache index {}.'.format(RAW_CACHE_INDEX))
+
+
+class _CsvCheck(object):
+    """ Checks an Ogimet csv block by block: the header, the number of columns
+    of every line and that the last line is complete. """
+
+    def __init__(self):
+        self.tail = b''
+        self.n_commas = None
+        self.n_lines = 0
+        self.size = 0
+
+    def feed(self, data):
+        self.size += len(data)
+        lines = (self.tail + data).split(b'\n')
+        self.tail = lines.pop()
+        for line in lines:
+            self.n_lines += 1
+            if self.n_commas is None and not line.strip():
+                continue
+            elif self.n_commas is None:
+                header = line.rstrip(b'\r').split(b',')
+                if header[:len(OGIMET_FIELDS)] != OGIMET_FIELDS:
+                    raise ValueError('Unexpected header {!r}'.format(line[:100]))
+                self.n_commas = len(header) - 1
+            elif line.count(b',') != self.n_commas and line.strip():
+                raise ValueError('Wrong number of columns in line {}'.format(self.n_lines))
+
+    def close(self, allow_empty=False):
+        if self.n_commas is None and not self.tail.strip():
+            if not allow_empty:
+                raise ValueError('Empty response')
+        elif self.tail:
+            raise ValueError('Truncated response')
+
+
+def validate_csv(data, allow_empty=False):
+    '''
+    Checks a downloaded Ogimet csv before it is used.
+
+    Arguments:
+    ----------
+    data (bytes of the response)
+    allow_empty = False (accept an empty response, i.e. no observations)
+
+    Returns:
+    --------
+    None, raises ValueError if the response is empty, has an unexpected header,
+    rows with the wrong number of columns or is truncated
+
+    '''
+    check = _CsvCheck()
+    check.feed(data)
+    check.close(allow_empty)
+
+
+def fetch(url, retries=5, backoff=2, allow_empty=False, limiter=None):
+    '''
+    Downloads url with the shared client and validates it as Ogimet csv.
+    Failed requests and invalid responses are retried with exponential
+    backoff and jitter.
+
+    Arguments:
+    ----------
+    url (to download)
+    retries = 5 (number of retries)
+    backoff = 2 (base delay in seconds, doubled for every retry)
+    allow_empty = False (accept an empty response)
+    limiter = None (RateLimiter, a token is taken before every attempt)
+
+    Returns:
+    --------
+    bytes of the response
+
+    '''
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            r = http.request('GET', url)
+            if r.status != 200:
+                raise IOError('HTTP status {}'.format(r.status))
+            validate_csv(r.data, allow_empty)
+            return r.data
+        except (IOError, ValueError, urllib3.exceptions.HTTPError) as e:
+            if attempt == retries:
+                raise IOError('Download of {} failed: {}'.format(url, e))
+            delay = random.uniform(0, min(60, backoff * 2**attempt))
+            print('Download failed ({}), retrying in {:.1f} s.'.format(e, delay))
+            time.sleep(delay)
+
+
+class OgimetStream(io.RawIOBase):
+    """ Readable body of an Ogimet response as it arrives. The bytes are
+    validated on the way and copied to path, which is put in place (and
+    recorded in the raw cache) only once the body is complete and valid. """
+
+    def __init__(self, response, url, path=None):
+        self.response = response
+        self.url = url
+        self.path = path
+        self.check = _CsvCheck()
+        self.out = (None if path is None else
+                    open_file(path + '.tmp', 'wb', compression(path)))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            data = self.response.read(len(b))
+            if not data and self.check.n_commas is None and not self.check.tail.strip():
+                # No reports in the period, read (and saved) as the header only
+                data = EMPTY_CSV
+            if not data:
+                self._finish()
+                return 0
+            self.check.feed(data)
+        except (ValueError, urllib3.exceptions.HTTPError) as e:
+            raise IOError('Download of {} failed: {}'.format(self.url, e))
+        if self.out is not None:
+            self.out.write(data)
+        b[:len(data)] = data
+        return len(data)
+
+    def _finish(self):
+        self.check.close()
+        if self.out is not None and not self.out.closed:
+            self.out.close()
+            os.replace(self.path + '.tmp', self.path)
+            print('Saved file to {}.'.format(self.path))
+            now = datetime.utcnow()
+            _touch_raw_cache(self.path, {'fetched': now.isoformat(),
+                                         'size': os.path.getsize(self.path)}, now)
+
+    def close(self):
+        if self.out is not None and not self.out.closed:
+            # Incomplete download, nothing is kept
+            self.out.close()
+            os.remove(self.path + '.tmp')
+        self.response.release_conn()
+        super(OgimetStream, self).close()
+
+
+def open_url(url, path=None, retries=5, backoff=2, settle=SETTLE_TIME,
+             refresh=REFRESH_TIME):
+    '''
+    Opens an Ogimet csv for reading while it downloads. If path is given, the
+    file is taken from the raw cache when it is still fresh (see
+    download_and_save), otherwise the downloaded bytes are also saved to path.
+    Failures before the first byte are retried as in fetch.
+
+    Arguments:
+    ----------
+    url (to download)
+    path = None (where to save the file on disk)
+    retries = 5, backoff = 2 (see fetch)
+    settle = SETTLE_TIME, refresh = REFRESH_TIME (see download_and_save)
+
+    Returns:
+    --------
+    readable binary file object, to be closed after use
+
+    Examples:
+    ---------
+    from synop_download import url_any_hour, open_url
+    url, path = url_any_hour(2018, 2, 1, 12)
+    with open_url(url, path) as f:
+        df = pd.read_csv(f)
+
+    '''
+    if path is not None:
+        path = os.path.abspath(path)
+        now = datetime.utcnow()
+        entry, fresh = _raw_cache_lookup(path, url, settle, refresh, now)
+        if fresh:
+            print('Using an existing file stored in {}.'.format(path))
+            _touch_raw_cache(path, entry, now)
+            return open_file(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    for attempt in range(retries + 1):
+        try:
+            r = http.request('GET', url, preload_content=False)
+            if r.status == 200:
+                return OgimetStream(r, url, path)
+            r.release_conn()
+            raise IOError('HTTP status {}'.format(r.status))
+        except (IOError, urllib3.exceptions.HTTPError) as e:
+            if attempt == retries:
+                raise IOError('Download of {} failed: {}'.format(url, e))
+            delay = random.uniform(0, min(60, backoff * 2**attempt))
+            print('Download failed ({}), retrying in {:.1f} s.'.format(e, delay))
+            time.sleep(delay)
+
+
+class RateLimiter(object):
+    """ Token bucket shared by the download threads: allows bursts of up to
+    burst requests and on average rate requests per second. """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a request may be sent. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _chunks(start, end, chunk_days):
+    '''Splits start to end (inclusive) into periods of at most chunk_days days.'''
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days) - timedelta(minutes=1), end)
+        chunks.append((start, chunk_end))
+        start = chunk_end + timedelta(minutes=1)
+    return chunks
+
+
+def download_range(start, end, stations, chunk_days=180, max_in_flight=2,
+                   requests_per_minute=6, base_url=OGIMET_URL, path=None,
+                   lang='eng', header='yes'):
+    '''
+    Function to download a long time series of SYNOP observations for one or
+    more stations (or blocks of stations, e.g. '11'). The period is split into
+    chunks that are fetched concurrently, limited by a token bucket, and the
+    results are stitched into one file per station.
+
+    Arguments:
+    ----------
+    start, end (datetime of the first and last observation)
+    stations (station or block, or list of them)
+    chunk_days = 180 (length of the period of one request)
+    max_in_flight = 2 (maximum number of concurrent requests)
+    requests_per_minute = 6 (average request rate)
+    base_url = OGIMET_URL (getsynop url, e.g. of a local stand-in server)
+    path = None (directory of the station data, default
+    ~/Documents/Synop_data/StationData)
+    lang = 'eng', header = 'yes'
+
+    Returns:
+    --------
+    dict of station -> path of the saved file (same naming as url_timeseries)
+
+    Examples:
+    ---------
+    from datetime import datetime
+    from synop_download import download_range
+    paths = download_range(datetime(1990, 1, 1), datetime(2004, 12, 31, 23), '04301')
+
+    '''
+    if path is None:
+        path = expanduser('~') + '/Documents/Synop_data/StationData'
+    if isinstance(stations, str):
+        stations = [stations]
+    jobs = [(str(block), start, end) for block in stations]
+    df = _fetch_periods(jobs, chunk_days, max_in_flight, requests_per_minute, base_url,
+                        lang, header)
+    if df is None:
+        return {}
+
+    save_str = start.strftime('%Y%m%d%H%M') + '-' + end.strftime('%Y%m%d%H%M')
+    paths = {}
+    for station, df_station in df.groupby('ESTACION'):
+        station_path = os.path.join(path, station)
+        os.makedirs(station_path, exist_ok=True)
+        paths[station] = os.path.join(station_path,
+                                      'synop_' + station + '_' + save_str + RAW_SUFFIX)
+        with open_file(paths[station] + '.tmp', 'wt', compression(paths[station])) as f:
+            df_station.to_csv(f, index=False)
+        os.replace(paths[station] + '.tmp', paths[station])
+        print('Saved file to {}.'.format(paths[station]))
+    return paths
+
+
+def _fetch_periods(periods, chunk_days=180, max_in_flight=2, requests_per_minute=6,
+                   base_url=OGIMET_URL, lang='eng', header='yes'):
+    '''
+    Fetches a list of (block, start, end) periods in chunks of at most
+    chunk_days concurrently (see download_range) and returns the reports as one
+    sorted DataFrame of strings without duplicates, None if there are none.
+    '''
+    limiter = RateLimiter(requests_per_minute / 60)
+
+    def fetch_chunk(block, chunk_start, chunk_end):
+        dic = {'block': block, 'begin': chunk_start.strftime('%Y%m%d%H%M'),
+               'end': chunk_end.strftime('%Y%m%d%H%M'), 'lang': lang, 'header': header}
+        url = base_url + '&'.join('{}={}'.format(key, value) for key, value in dic.items())
+        # Retries wait for the limiter as well
+        data = fetch(url, allow_empty=True, limiter=limiter)
+        print('Downloaded {} {} - {}.'.format(block, chunk_start, chunk_end))
+        if not data.strip():
+            return None
+        return pd.read_csv(io.BytesIO(data), dtype=str)
+
+    jobs = [(block, chunk_start, chunk_end) for block, start, end in periods
+            for chunk_start, chunk_end in _chunks(start, end, chunk_days)]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        results = [df for df in pool.map(lambda job: fetch_chunk(*job), jobs) if df is not None]
+    if not results:
+        return None
+    df = pd.concat(results, ignore_index=True).drop_duplicates()
+    return df.sort_values(REPORT_KEY, kind='mergesort')
+
+
+def download_station(station, start, end, path=None, settle=SETTLE_TIME, **kwargs):
+    '''
+    Function to keep a growing store of all SYNOP observations of a station in
+    one file. The periods already stored are recorded in coverage.json next to
+    the file; only the parts of start to end that are missing are downloaded
+    and merged into the store, reports of the same station and time are kept
+    once. Periods that ended less than settle ago are not recorded as covered,
+    so they are fetched again for late reports.
+
+    Arguments:
+    ----------
+    station (WMO id, e.g. '04301')
+    start, end (datetime of the first and last observation)
+    path = None (directory of the station data, default
+    ~/Documents/Synop_data/StationData)
+    settle = SETTLE_TIME (see download_and_save)
+    **kwargs (chunk_days, max_in_flight, requests_per_minute, base_url, lang,
+    header as for download_range)
+
+    Returns:
+    --------
+    path of the store (StationData/<station>/synop_<station>.csv)
+
+    Examples:
+    ---------
+    from datetime import datetime
+    from synop_download import download_station
+    path = download_station('04360', datetime(2020, 4, 20), datetime(2020, 4, 27, 10))
+
+    '''
+    station = str(station)
+    stores = download_block(station, start, end, path, settle, **kwargs)
+    if path is None:
+        path = expanduser('~') + '/Documents/Synop_data/StationData'
+    return stores.get(station, _store_path(path, station))
+
+
+def download_block(block, start, end, path=None, settle=SETTLE_TIME, **kwargs):
+    '''
+    Function to download all stations of a block (e.g. '11', see
+    url_timeseries) with one request per period and to split the reports into
+    the per-station stores of download_station. The block keeps its own
+    coverage.json, so a period is only requested once per block, and the
+    stations get the period added to their coverage, so download_station of
+    any of them does not download it again.
+
+    Arguments:
+    ----------
+    block (prefix of the WMO ids, or a full WMO id)
+    start, end, path = None, settle = SETTLE_TIME, **kwargs (see
+    download_station)
+
+    Returns:
+    --------
+    dict of station -> path of its store
+
+    Examples:
+    ---------
+    from datetime import datetime
+    from synop_download import download_block
+    stores = download_block('11', datetime(2018, 2, 1), datetime(2018, 2, 28, 23))
+
+    '''
+    block = str(block)
+    if path is None:
+        path = expanduser('~') + '/Documents/Synop_data/StationData'
+    block_path = os.path.join(path, block)
+    covered = _read_coverage(block_path)
+    missing = _missing_periods(start, end, covered)
+    stations = [os.path.basename(d) for d in glob.glob(os.path.join(path, block + '*'))]
+    stores = {station: _store_path(path, station) for station in stations
+              if len(station) == 5 and os.path.exists(_store_path(path, station))}
+    if not missing:
+        print('Using the stored observations of {} in {}.'.format(block, path))
+        return stores
+
+    now = datetime.utcnow()
+    df = _fetch_periods([(block, s, e) for s, e in missing], **kwargs)
+    # Only settled periods count as covered
+    settled = [(s, min(e, now - settle)) for s, e in missing if s <= now - settle]
+    if df is not None:
+        for station, df_station in df.groupby('ESTACION'):
+            station_path = os.path.join(path, station)
+            stores[station] = _store_path(path, station)
+            _merge_store(stores[station], df_station)
+            if station != block:
+                _write_coverage(station_path, _read_coverage(station_path) + settled)
+    _write_coverage(block_path, covered + settled)
+    return stores
+
+
+def _store_path(path, station):
+    '''Path of the store of station in the station data directory path.'''
+    return os.path.join(path, station, 'synop_' + station + RAW_SUFFIX)
+
+
+def _merge_store(store, df):
+    '''Merges the reports of df into store, the reports of df win.'''
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+    if os.path.exists(store):
+        df = pd.concat([pd.read_csv(store, dtype=str), df], ignore_index=True)
+        df = df.drop_duplicates(REPORT_KEY, keep='last')
+        df = df.sort_values(REPORT_KEY, kind='mergesort')
+    with open_file(store + '.tmp', 'wt', compression(store)) as f:
+        df.to_csv(f, index=False)
+    os.replace(store + '.tmp', store)
+    print('Saved file to {}.'.format(store))
+
+
+def _read_coverage(station_path):
+    '''
+    Returns the stored periods of a station or block directory. The coverage of
+    a station is only valid as long as its store exists.
+    '''
+    coverage_path = os.path.join(station_path, 'coverage.json')
+    station = os.path.basename(station_path)
+    if not os.path.exists(coverage_path) or (
+            len(station) == 5 and not os.path.exists(_store_path(os.path.dirname(station_path),
+                                                                 station))):
+        return []
+    with open(coverage_path) as f:
+        return [tuple(datetime.strptime(t, '%Y%m%d%H%M') for t in period)
+                for period in json.load(f)]
+
+
+def _write_coverage(station_path, periods):
+    '''Stores the merged periods in coverage.json of a station or block directory.'''
+    os.makedirs(station_path, exist_ok=True)
+    coverage_path = os.path.join(station_path, 'coverage.json')
+    with open(coverage_path + '.tmp', 'w') as f:
+        json.dump([[t.strftime('%Y%m%d%H%M') for t in period]
+                   for period in _merge_periods(periods)], f)
+    os.replace(coverage_path + '.tmp', coverage_path)
+
+
+def _merge_periods(periods):
+    '''Merges overlapping and adjacent (one minute apart) periods.'''
+    merged = []
+    for start, end in sorted(periods):
+        if merged and start <= merged[-1][1] + timedelta(minutes=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _missing_periods(start, end, covered):
+    '''Returns the parts of start to end (inclusive, in minutes) not in covered.'''
+    missing = []
+    for cov_start, cov_end in _merge_periods(covered):
+        if cov_end < start or cov_start > end:
+            continue
+        if cov_start > start:
+            missing.append((start, cov_start - timedelta(minutes=1)))
+        start = cov_end + timedelta(minutes=1)
+    if start <= end:
+        missing.append((start, end))
+    return missing
 
 
 if __name__ == 'main':
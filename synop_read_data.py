@@ -1,75 +1,759 @@
-import datetime as dt
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import time
+import zipfile
+from os.path import expanduser
 import pandas as pd
 import numpy as np
-from synop_download import url_last_hour, url_any_hour, download_and_save
-from metpy.units import units
-
-
-def synop_df(path, timeseries=False):
-    # Load lat lon dataset
-    fields = ['RegionId', 'RegionName', 'CountryArea', 'CountryCode', 'StationId',
-              'IndexNbr', 'IndexSubNbr', 'StationName', 'Latitude', 'Longitude', 'Hp',
-              'HpFlag', 'Hha', 'HhaFlag', 'PressureDefId']
-    df_latlon = pd.read_csv('./Input/station_latlon.csv',
-                            usecols=fields)
-    df_latlon[['Lat_deg', 'Lat_mins', 'Lat_sec']] = (df_latlon['Latitude'].
-                                                     str.split(' ', expand=True))
-    df_latlon[['Lon_deg', 'Lon_mins', 'Lon_sec']] = (df_latlon['Longitude'].
-                                                     str.split(' ', expand=True))
-    # Find E or W (N or S)
-    df_latlon['E_or_W'] = df_latlon['Lon_sec'].str[-1]
-    df_latlon['Lon_sec'] = df_latlon['Lon_sec'].str[0:-1]
-
-    df_latlon['N_or_S'] = df_latlon['Lat_sec'].str[-1]
-    df_latlon['Lat_sec'] = df_latlon['Lat_sec'].str[0:-1]
 
+# Wind speed conversions, the factors of metpy.units (too slow to import for two numbers)
+MS_TO_KNOTS = 1.9438444924406049
+KNOTS_TO_KPH = 1.852
+
+
+def _match_groups(tokens, prefixes, names):
+    '''
+    Assign the groups of a tokenized report to their indicator slots in a
+    single vectorized pass.
+
+    Arguments:
+    ----------
+    tokens (DataFrame with one group per column, no missing values)
+    prefixes (list of indicator strings, e.g. ['1', ..., '9', '910'])
+    names (column names of the returned DataFrame, one per prefix)
+
+    Returns:
+    --------
+    DataFrame holding, for every prefix, the last group starting with it
+    (NaN if the report contains no such group)
+
+    '''
+    values = tokens.to_numpy(dtype=object)
+    n_rows, n_cols = values.shape
+    if n_rows == 0 or n_cols == 0:
+        return pd.DataFrame(np.nan, index=tokens.index, columns=names, dtype=object)
+    picked = np.empty((n_rows, len(prefixes)), dtype=object)
+    rows = np.arange(n_rows)[:, np.newaxis]
+    prefixes = np.array(prefixes)
+    widths = np.char.str_len(prefixes)
+    # Only the leading characters are compared, long (garbage) groups are truncated
+    text = values.astype('U{}'.format(widths.max()))
+    for width in np.unique(widths):
+        # Fixed-width view on the leading characters of every group
+        heads = text.astype('U{}'.format(width))
+        cols = np.flatnonzero(widths == width)
+        # Reverse the columns so argmax finds the last matching group
+        hits = heads[:, ::-1, np.newaxis] == prefixes[cols]
+        last = n_cols - 1 - hits.argmax(axis=1)
+        found = hits.any(axis=1)
+        matched = values[rows, last]
+        matched[~found] = np.nan
+        picked[:, cols] = matched
+    return pd.DataFrame(picked, index=tokens.index, columns=names)
+
+
+def _group_codes(group, width=5):
+    '''
+    Fixed-width view of a column of SYNOP groups as unicode code points.
+
+    Arguments:
+    ----------
+    group (Series of group strings, may contain NaN)
+    width = 5 (number of characters of a complete group)
+
+    Returns:
+    --------
+    uint32 array of shape (n, width + 1), padded with zeros. A non-zero last
+    column marks groups longer than width characters.
+
+    '''
+    buf = group.fillna('').to_numpy(dtype='U{}'.format(width + 1))
+    return buf.view(np.uint32).reshape(-1, width + 1)
+
+
+def _well_formed(codes):
+    '''Mask of the groups of exactly 5 digits or slashes (see _group_codes).'''
+    # '/' directly precedes '0' to '9'
+    return (codes[:, :5] - ord('/') <= 10).all(axis=1) & (codes[:, 5] == 0)
+
+
+def _digits(codes):
+    '''
+    Returns the digit values (int16, 0 for non-digits) and the digit mask of
+    codes. Malformed groups (see _well_formed) have no digits, so every field
+    decoded from them is masked.
+    '''
+    digits = codes - ord('0')
+    is_digit = (digits < 10) & _well_formed(codes)[:, np.newaxis]
+    return np.where(is_digit, digits, 0).astype(np.int16), is_digit
+
+
+# _group_codes of the 'XXXXX' put in place of groups that are not reported
+_FILLER = np.array([ord('X')] * 5 + [0], dtype=np.uint32)
+
+
+def _malformed_groups(df, fields, group, codes):
+    '''
+    Returns the groups that are present but malformed as a DataFrame with the
+    columns Station, time, fields, group and reason (None if there are none).
+
+    Arguments:
+    ----------
+    df (reports as in _decode, with the columns Statindex and time)
+    fields (names of the fields decoded from the group)
+    group (Series of groups), codes (their _group_codes)
+
+    '''
+    bad = ~_well_formed(codes) & (codes[:, 0] != 0)
+    # Groups filled in for missing ones are not malformed
+    bad[bad] = ~(codes[bad] == _FILLER).all(axis=1)
+    if not bad.any():
+        return None
+    wrong_length = (codes[bad, 5] != 0) | (codes[bad, :5] == 0).any(axis=1)
+    return pd.DataFrame({'Station': df['Statindex'][bad], 'time': df['time'][bad],
+                         'fields': fields, 'group': group[bad],
+                         'reason': np.where(wrong_length, 'wrong length', 'invalid characters')},
+                        columns=REJECT_COLUMNS)
+
+
+def _decode_temperature(codes):
+    '''Decodes the codes of 1sTTT and 2sTdTdTd groups to tenths of degC and a validity mask.'''
+    digits, is_digit = _digits(codes)
+    sign = digits[:, 1]
+    valid = is_digit[:, :5].all(axis=1) & (codes[:, 5] == 0) & (sign <= 1)
+    tenths = (digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4]) * (1 - 2 * sign)
+    return tenths.astype(np.int16), valid
+
+
+def _decode_pressure(codes):
+    '''Decodes the codes of 3PPPP and 4PPPP groups to tenths of hPa and a validity mask.'''
+    digits, is_digit = _digits(codes)
+    lead = digits[:, 1]
+    valid = (is_digit[:, :5].all(axis=1) & (codes[:, 5] == 0) &
+             ((lead == 0) | (lead >= 7)))
+    tenths = (lead * 1000 + digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4] +
+              10000 * (lead == 0))
+    return tenths.astype(np.int16), valid
+
+
+def _decode_tendency(codes):
+    '''Decodes the ppp of the codes of 5appp groups to tenths of hPa and a validity mask.'''
+    digits, is_digit = _digits(codes)
+    valid = is_digit[:, 2:5].all(axis=1) & (codes[:, 5] == 0)
+    tenths = digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4]
+    # Negative if the middle digit of ppp is 5 to 8
+    falling = (digits[:, 3] >= 5) & (digits[:, 3] <= 8)
+    tenths = np.where(falling, -tenths, tenths)
+    return tenths.astype(np.int16), valid
+
+
+def _decode_pair(codes, start):
+    '''Decodes the two digits of the group codes at position start and a validity mask.'''
+    digits, is_digit = _digits(codes)
+    valid = is_digit[:, start] & is_digit[:, start + 1]
+    return (digits[:, start] * 10 + digits[:, start + 1]).astype(np.int16), valid
+
+
+def _as_float(values, valid, scale=1):
+    '''Returns values / scale as float64 with NaN where not valid.'''
+    if scale == 1:
+        return np.where(valid, values, np.nan)
+    return np.where(valid, values / scale, np.nan)
+
+
+STATION_CSV = './Input/station_latlon.csv'
+STATION_INDEX = './Input/station_latlon.npz'
+# Columns of the station list in the decoded output, in order
+STATION_COLUMNS = ['RegionId', 'RegionName', 'CountryArea', 'CountryCode', 'StationId',
+                   'IndexNbr', 'IndexSubNbr', 'StationName', 'Latitude', 'Longitude', 'Hp',
+                   'HpFlag', 'Hha', 'HhaFlag', 'PressureDefId', 'Lat_deg', 'Lat_mins',
+                   'Lat_sec', 'Lon_deg', 'Lon_mins', 'Lon_sec', 'E_or_W', 'N_or_S',
+                   'latitude', 'longitude']
+# String columns of the station index (missing values are stored as '')
+STATION_TEXT = ['RegionName', 'CountryArea', 'CountryCode', 'StationId', 'StationName',
+                'Latitude', 'Longitude', 'PressureDefId', 'Lat_deg', 'Lon_deg', 'E_or_W',
+                'N_or_S']
+_station_cache = {}
+
+
+def _split_dms(df_latlon, col, prefix, hemisphere):
+    '''
+    Splits the 'DD MM SSH' strings of col (H one of N, S, E, W) into the
+    columns <prefix>_deg (str), <prefix>_mins, <prefix>_sec (in degrees) and
+    hemisphere, and returns the signed decimal degrees.
+    '''
+    parts = df_latlon[col].str.split(' ', expand=True)
+    df_latlon[hemisphere] = parts[2].str[-1]
+    df_latlon[prefix + '_deg'] = parts[0]
     # Convert arcmin and sec to degrees
-    df_latlon['Lat_mins'] = df_latlon['Lat_mins'].astype(float) / 60
-    df_latlon['Lat_sec'] = df_latlon['Lat_sec'].astype(
-        float) / (60**2)
-
-    df_latlon['Lon_mins'] = df_latlon['Lon_mins'].astype(float) / 60
-    df_latlon['Lon_sec'] = df_latlon['Lon_sec'].astype(
-        float) / (60**2)
-
-    df_latlon['latitude'] = (df_latlon['Lat_deg'].astype(float) + df_latlon['Lat_mins'].
-                             astype(float) + df_latlon['Lat_sec'])
-
-    df_latlon['longitude'] = (df_latlon['Lon_deg'].astype(float) + df_latlon['Lon_mins'].
-                              astype(float) + df_latlon['Lon_sec'])
-    # Extract station ID for comparison
-    df_latlon['Station'] = df_latlon['StationId'].str[-5:]
-
-    def _dateparser(y, m, d, h, M):
-        return dt.datetime(int(y), int(m), int(d), int(h), int(M))
-
-    def load_main(filename):
-        fields = ['ESTACION', 'ANO', 'MES',
-                  'DIA', 'HORA', 'MINUTO', 'PARTE']
-        df = pd.read_csv(filename, usecols=fields)
-        list_one = ['Station', 'Year', 'Month',
-                    'Day', 'Hour', 'Minute', 'Report']
+    df_latlon[prefix + '_mins'] = parts[1].astype(float) / 60
+    df_latlon[prefix + '_sec'] = parts[2].str[0:-1].astype(float) / (60**2)
+    degrees = (parts[0].astype(float) + df_latlon[prefix + '_mins'] +
+               df_latlon[prefix + '_sec'])
+    return np.where(df_latlon[hemisphere].isin(['S', 'W']), degrees * (-1), degrees)
+
+
+def build_station_index(csv_path=STATION_CSV, index_path=STATION_INDEX):
+    '''
+    Compiles the WMO station list into an .npz station index.
+
+    Arguments:
+    ----------
+    csv_path = STATION_CSV (WMO station list)
+    index_path = STATION_INDEX (where to save the index)
+
+    Returns:
+    --------
+    dict of arrays: 'wmo' (int32 5-digit WMO ids), 'row' (int32 lookup table,
+    row of each WMO id or -1), the STATION_COLUMNS and 'csv_mtime'
+
+    Examples:
+    ---------
+    from synop_read_data import build_station_index
+    build_station_index()
+
+    '''
+    fields = STATION_COLUMNS[:15]
+    df_latlon = pd.read_csv(csv_path, usecols=fields)
+    df_latlon['wmo'] = pd.to_numeric(df_latlon['StationId'].str[-5:], errors='coerce')
+    df_latlon = df_latlon[df_latlon['wmo'].notnull()].reset_index(drop=True)
+    wmo = df_latlon['wmo'].to_numpy(dtype=np.int32)
+    # Lookup table from WMO id to row, the first entry of an id is used
+    row = np.full(100000, -1, dtype=np.int32)
+    first = ~pd.Series(wmo).duplicated().to_numpy()
+    row[wmo[first]] = np.flatnonzero(first)
+
+    df_latlon['latitude'] = _split_dms(df_latlon, 'Latitude', 'Lat', 'N_or_S')
+    df_latlon['longitude'] = _split_dms(df_latlon, 'Longitude', 'Lon', 'E_or_W')
+    index = {'wmo': wmo, 'row': row,
+             'csv_mtime': np.float64(os.path.getmtime(csv_path))}
+    for col in STATION_COLUMNS:
+        if col in STATION_TEXT:
+            index[col] = df_latlon[col].fillna('').to_numpy(dtype=str)
+        else:
+            index[col] = df_latlon[col].to_numpy()
+
+    try:
+        # One temporary file per process, parallel decoders may rebuild at once
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        print('Could not save the station index to {}.'.format(index_path))
+    return index
+
+
+def load_station_index(csv_path=STATION_CSV, index_path=STATION_INDEX):
+    '''
+    Returns the station index, rebuilding it when the station list changed.
+
+    Arguments:
+    ----------
+    csv_path = STATION_CSV (WMO station list)
+    index_path = STATION_INDEX (compiled index)
+
+    Returns:
+    --------
+    dict of arrays (see build_station_index)
+
+    '''
+    csv_mtime = os.path.getmtime(csv_path)
+    cached = _station_cache.get(index_path)
+    if cached is not None and cached['csv_mtime'] == csv_mtime:
+        return cached
+    index = None
+    if os.path.exists(index_path):
+        try:
+            with np.load(index_path) as f:
+                # Indexes of older versions lack columns and are rebuilt
+                if f['csv_mtime'] == csv_mtime and set(STATION_COLUMNS) <= set(f.files):
+                    index = {key: f[key] for key in f.files}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            print('Could not read the station index {}, rebuilding it.'.format(index_path))
+    if index is None:
+        index = build_station_index(csv_path, index_path)
+    _station_cache[index_path] = index
+    return index
+
+
+def _station_lookup(station, index):
+    '''
+    Looks up the 5-digit station ids in the station index.
+
+    Returns:
+    --------
+    int array with the index row of every station (-1 if unknown)
+
+    '''
+    codes = _group_codes(station)
+    digits, is_digit = _digits(codes)
+    valid = is_digit[:, :5].all(axis=1) & (codes[:, 5] == 0)
+    wmo = (digits[:, :5].astype(np.int32) * [10000, 1000, 100, 10, 1]).sum(axis=1)
+    return np.where(valid, index['row'][wmo], -1)
+
+
+# Start of the sections 222, 333 and 555 (the space before is consumed only)
+_SECTION_MARKER = re.compile(r'(?:^| )(?=(222|333 |555 ))')
+
+
+def _section_spans(text):
+    '''
+    Start offsets of the sections 1, 222, 333 and 555 of a report (-1 if
+    missing) and the sections themselves.
+    '''
+    first = {}
+    for m in _SECTION_MARKER.finditer(text):
+        first.setdefault(m.group(1)[:3], m)
+    starts = [0, -1, -1, -1]
+    parts = [None, np.nan, np.nan, np.nan]
+    end = len(text)
+    # Section 555 runs to the end, 333 ends at 555 and 222 at 333 (or 555)
+    for i, sec in [(3, '555'), (2, '333'), (1, '222')]:
+        m = first.get(sec)
+        if m is not None and m.start() < end:
+            # The 222 section keeps its 222Dv group
+            starts[i] = m.start(1) if sec == '222' else m.end(1)
+            parts[i] = text[starts[i]:end]
+            end = m.start()
+    parts[0] = text[:end]
+    return starts + parts
+
+
+def split_sections(rest):
+    '''
+    Splits the groups following Nddff into the sections 1, 222, 333 and 555
+    with a single scan per report.
+
+    Arguments:
+    ----------
+    rest (Series of report strings without the first five groups)
+
+    Returns:
+    --------
+    DataFrame with the sections '1', '222', '333', '555' (NaN if missing, the
+    222 section keeps its 222Dv group) and their start offsets in rest
+    '1_start', '222_start', '333_start', '555_start' (-1 if missing)
+
+    '''
+    names = ['1', '222', '333', '555']
+    missing = [-1] * 4 + [np.nan] * 4
+    spans = zip(*[_section_spans(text) if isinstance(text, str) else missing
+                  for text in rest])
+    columns = [x + '_start' for x in names] + names
+    sections = pd.DataFrame(dict(zip(columns, spans)), index=rest.index, columns=columns)
+    # Keep the sections as strings, even if no report has them
+    sections[names] = sections[names].astype(object)
+    return sections[[x for sec in names for x in [sec, sec + '_start']]]
+
+
+def load_main(filename, chunksize=None):
+    '''
+    Reads an Ogimet SYNOP csv file.
+
+    Arguments:
+    ----------
+    filename (csv file as saved by download_and_save, .gz and .zst files are
+    decompressed on the fly)
+    chunksize = None (if given, an iterator over DataFrames of chunksize rows
+    is returned)
+
+    Returns:
+    --------
+    DataFrame (or iterator of DataFrames) with the columns Station, Year,
+    Month, Day, Hour, Minute, Report and time
+
+    '''
+    fields = ['ESTACION', 'ANO', 'MES',
+              'DIA', 'HORA', 'MINUTO', 'PARTE']
+    list_one = ['Station', 'Year', 'Month',
+                'Day', 'Hour', 'Minute', 'Report']
+
+    def _prepare(df):
         df.columns = list_one
         # Create time columns and make it the index
+        # Impossible dates become NaT, those reports are rejected by the decoder
         df['time'] = pd.to_datetime(
-            df[['Year', 'Month', 'Day', 'Hour', 'Minute']])
+            df[['Year', 'Month', 'Day', 'Hour', 'Minute']], errors='coerce')
         # Fill the missing values
         df.fillna(value=np.nan, inplace=True)
-        # df_report.fillna(value=np.nan, inplace=True)
         return df
 
-    def load_report(filename):
-        fields = ['PARTE']
-        df = pd.read_csv(filename, usecols=fields)
-        list_one = ['Report']
-        df.columns = list_one
-        # Fill the missing values
-        # df.fillna(value=np.nan, inplace=True)
-        # df_report.fillna(value=np.nan, inplace=True)
-        return df
+    # Station ids are read as strings to keep the leading zeros
+    reader = pd.read_csv(filename, usecols=fields, dtype={'ESTACION': str},
+                         chunksize=chunksize)
+    if chunksize is None:
+        return _prepare(reader)
+    return (_prepare(df) for df in reader)
+
+
+# Bump whenever the decoded output changes, so cached decodes are not reused
+DECODER_VERSION = 5
+# Columns of the table of rejected reports and groups
+REJECT_COLUMNS = ['Station', 'time', 'fields', 'group', 'reason']
+DECODE_CACHE = expanduser('~') + '/Documents/Synop_data/decode_cache'
+# Maximum total size of the decode cache in bytes
+DECODE_CACHE_SIZE = 2**30
+
+
+def synop_df(path, timeseries=False, cache=True, compact=False, rejects=None):
+    '''
+    Decodes all the SYNOP reports of an Ogimet csv file.
+
+    Arguments:
+    ----------
+    path (csv file as saved by download_and_save)
+    timeseries = False (if False only the first report of every station is
+    kept)
+    cache = True (reuse the decoded result of a file with the same content,
+    stored in DECODE_CACHE)
+    compact = False (return final_df with the compact dtypes of compact_schema)
+    rejects = None (list, the table of rejected reports and malformed groups
+    is appended to it, with the columns of REJECT_COLUMNS. Rejected reports
+    are left out of final_df, the fields of malformed groups are NaN)
+
+    Returns:
+    --------
+    final_df (decoded observations with station metadata)
+    df_climat (groups of the 333 section)
+
+    Examples:
+    ---------
+    from synop_read_data import synop_df
+    df_synop, df_climat = synop_df(path, timeseries=True)
+
+    rejects = []
+    df_synop, df_climat = synop_df(path, rejects=rejects)
+    print(rejects[0].groupby('reason').size())
+
+    '''
+    if cache:
+        cache_path = _decode_cache_path(path, timeseries)
+    if cache and os.path.exists(cache_path):
+        # Mark as recently used for the eviction
+        os.utime(cache_path)
+        final_df, df_climat, rejected = pd.read_pickle(cache_path)
+    else:
+        # Load the data into a dataframe
+        df = load_main(path)
+        found = []
+        final_df, df_climat = _decode(df, timeseries, rejects=found)
+        rejected = found[0]
+        if cache:
+            _write_decode_cache(cache_path, (final_df, df_climat, rejected))
+    if rejects is not None:
+        rejects.append(rejected)
+    if compact:
+        final_df = compact_schema(final_df)
+    return final_df, df_climat
+
 
-    # Load the data into a dataframe
-    df = load_main(path)
+def _decode_cache_path(path, timeseries):
+    '''
+    Cache file of a raw file, keyed on its content, the decoder version and the
+    station list.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(os.path.getmtime(STATION_CSV)).encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    key = '{}_v{}_{}'.format(digest.hexdigest(), DECODER_VERSION,
+                             'ts' if timeseries else 'snap')
+    return os.path.join(DECODE_CACHE, key + '.pkl')
+
+
+def _write_decode_cache(cache_path, result):
+    '''Stores a decoded result and evicts the least recently used entries.'''
+    try:
+        os.makedirs(DECODE_CACHE, exist_ok=True)
+        # Own temporary file, parallel decodes of the same file may write at once
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=DECODE_CACHE)
+        os.close(fd)
+        try:
+            pd.to_pickle(result, tmp_path, protocol=-1)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        entries = sorted(glob.glob(os.path.join(DECODE_CACHE, '*.pkl')),
+                         key=os.path.getmtime, reverse=True)
+        total = 0
+        for entry in entries:
+            size = os.path.getsize(entry)
+            if total + size > DECODE_CACHE_SIZE and entry != cache_path:
+                os.remove(entry)
+            else:
+                total += size
+    except OSError:
+        print('Could not save the decoded file to {}.'.format(cache_path))
+
+
+def synop_df_chunks(path, max_memory=256, chunksize=None, compact=False, rejects=None):
+    '''
+    Decodes a SYNOP time series file chunk by chunk, so the memory needed does
+    not grow with the length of the file.
+
+    Arguments:
+    ----------
+    path (csv file as saved by download_and_save, e.g. from url_timeseries)
+    max_memory = 256 (approximate memory ceiling of the decoding in MB)
+    chunksize = None (number of reports per chunk, derived from max_memory if
+    not given)
+    compact = False (return final_df with the compact dtypes of compact_schema)
+    rejects = None (list, the rejects of every chunk are appended to it, see
+    synop_df)
+
+    Returns:
+    --------
+    generator of (final_df, df_climat) as returned by
+    synop_df(path, timeseries=True), one per chunk (none if the period has
+    no reports)
+
+    Examples:
+    ---------
+    from synop_read_data import synop_df_chunks
+    for df_synop, df_climat in synop_df_chunks(path, max_memory=128):
+        print(df_synop['TT'].max())
+
+    '''
+    if chunksize is None:
+        chunksize = _chunksize(path, max_memory)
+    for df in load_main(path, chunksize=chunksize):
+        final_df, df_climat = _decode(df, timeseries=True, rejects=rejects)
+        if compact:
+            final_df = compact_schema(final_df)
+        yield final_df, df_climat
+
+
+def synop_df_stream(url, path=None, chunksize=10000, compact=False, rejects=None):
+    '''
+    Downloads and decodes a SYNOP file in one pass: the reports are decoded
+    chunk by chunk while the rest of the file is still downloading, and the
+    raw file is saved to path at the same time (see synop_download.open_url).
+
+    Arguments:
+    ----------
+    url (to download, e.g. from url_timeseries)
+    path = None (where to save the raw file, taken from there if still fresh)
+    chunksize = 10000 (number of reports per chunk)
+    compact = False (return final_df with the compact dtypes of compact_schema)
+    rejects = None (list, see synop_df_chunks)
+
+    Returns:
+    --------
+    generator of (final_df, df_climat) as returned by
+    synop_df(path, timeseries=True), one per chunk (none if the period has
+    no reports)
+
+    Examples:
+    ---------
+    from synop_download import url_timeseries
+    from synop_read_data import synop_df_stream
+    url, path = url_timeseries(2018, 1, 1, 0, 2018, 3, 1, 0, '04301')
+    for df_synop, df_climat in synop_df_stream(url, path):
+        print(df_synop['TT'].max())
+
+    '''
+    from synop_download import open_url
+    with open_url(url, path) as f:
+        for df in load_main(f, chunksize=chunksize):
+            if df.empty:
+                # Period without reports, the file holds the header only
+                continue
+            final_df, df_climat = _decode(df, timeseries=True, rejects=rejects)
+            if compact:
+                final_df = compact_schema(final_df)
+            yield final_df, df_climat
+
+
+def synop_df_to_csv(path, path_save, max_memory=256, chunksize=None):
+    '''
+    Decodes a SYNOP time series file chunk by chunk and appends the decoded
+    observations to path_save (same format as synop_df(...).to_csv). The file
+    is written atomically.
+
+    Arguments:
+    ----------
+    path (csv file as saved by download_and_save)
+    path_save (where to save the decoded csv file, compressed if it ends in
+    .gz or .zst)
+    max_memory = 256 (approximate memory ceiling of the decoding in MB)
+    chunksize = None (number of reports per chunk)
+
+    Returns:
+    --------
+    Number of decoded reports
+
+    '''
+    from synop_download import open_file, compression
+    n_rows = 0
+    # Write to a temporary file first, so path_save is either complete or absent
+    tmp_path = path_save + '.tmp'
+    try:
+        with open_file(tmp_path, 'wt', compression(path_save)) as f:
+            for i, (df_synop, df_climat) in enumerate(synop_df_chunks(path, max_memory,
+                                                                      chunksize)):
+                df_synop.index += n_rows
+                df_synop.to_csv(f, header=(i == 0))
+                n_rows += len(df_synop)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path_save)
+    return n_rows
+
+
+def decode_file(path, path_save, max_memory=256):
+    '''
+    Runs synop_df_to_csv and times it (used by SYNOP_ts.decode_multiple).
+
+    Returns:
+    --------
+    path_save, number of decoded reports, seconds needed
+
+    '''
+    start = time.time()
+    n_rows = synop_df_to_csv(path, path_save, max_memory=max_memory)
+    return path_save, n_rows, time.time() - start
+
+
+# Periods of the Precip_<h>h columns in hours
+PRECIP_HOURS = [6, 12, 18, 24, 1, 2, 3, 9, 15]
+# WMO code columns stored as nullable int8 in the compact schema
+CODE_COLUMNS = ['cloud_cover', 'StationType', 'ww', 'WW', 'ground_state']
+# Station metadata stored as categoricals in the compact schema
+CATEGORY_COLUMNS = ['RegionName', 'CountryArea', 'CountryCode', 'StationId', 'StationName',
+                    'PressureDefId']
+# Station list columns that repeat latitude and longitude, dropped in the compact schema
+DMS_COLUMNS = ['Latitude', 'Longitude', 'Lat_deg', 'Lat_mins', 'Lat_sec', 'Lon_deg',
+               'Lon_mins', 'Lon_sec', 'E_or_W', 'N_or_S']
+# Integer station list columns and their compact dtypes
+STATION_INT_COLUMNS = {'RegionId': 'int8', 'IndexNbr': 'int32', 'IndexSubNbr': 'int16'}
+
+
+def compact_schema(final_df):
+    '''
+    Converts a decoded final_df to compact dtypes.
+
+    Station becomes an int32 WMO id, the WMO code columns nullable int8, the
+    region, country and station text columns categoricals, the station list
+    numbers small ints and all other measurements float32. The nine mostly
+    empty Precip_<h>h columns are replaced by Precip_h, the period (hours) of
+    Precip, and the DMS_COLUMNS are dropped (see latitude and longitude).
+
+    Arguments:
+    ----------
+    final_df (as returned by synop_df)
+
+    Returns:
+    --------
+    compact DataFrame
+
+    Examples:
+    ---------
+    from synop_read_data import synop_df, compact_schema
+    df_synop, df_climat = synop_df(path, timeseries=True)
+    df_synop = compact_schema(df_synop)
+
+    '''
+    df = final_df.drop(columns=['Statindex'] + DMS_COLUMNS, errors='ignore')
+    precip_h = pd.Series(np.nan, index=df.index)
+    for hours in PRECIP_HOURS:
+        col = 'Precip_' + str(hours) + 'h'
+        if col in df.columns:
+            precip_h[df[col].notnull()] = hours
+            df = df.drop(columns=col)
+    if 'Precip' in df.columns:
+        df.insert(df.columns.get_loc('Precip') + 1, 'Precip_h', precip_h.astype('Int8'))
+
+    df['Station'] = pd.to_numeric(df['Station'], errors='coerce').astype('int32')
+    for col in df.columns:
+        if col in CODE_COLUMNS:
+            df[col] = df[col].astype('float32').astype('Int8')
+        elif col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif col in STATION_INT_COLUMNS:
+            df[col] = df[col].astype(STATION_INT_COLUMNS[col])
+        elif df[col].dtype == np.float64:
+            df[col] = df[col].astype('float32')
+    return df
+
+
+# Peak memory of the decoding per byte of raw report (measured ~32x)
+_DECODE_EXPANSION = 32
+
+
+def _chunksize(path, max_memory):
+    '''Number of reports to decode at once to stay below max_memory MB.'''
+    from synop_download import open_file
+    with open_file(path) as f:
+        head = f.read(2**16)
+    line_bytes = len(head) / max(head.count(b'\n'), 1)
+    return max(1000, int(max_memory * 2**20 / (line_bytes * _DECODE_EXPANSION)))
+
+
+def _lap(timings, stage, start):
+    '''Adds the seconds since start to timings[stage] and returns the current time.'''
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
+def _log_rejects(rejected, rejects):
+    '''Prints the number of rejected reports and groups and appends their table to rejects.'''
+    rejected = pd.concat([pd.DataFrame(columns=REJECT_COLUMNS)] + rejected,
+                         ignore_index=True)
+    if len(rejected):
+        print('Rejected {} malformed reports or groups.'.format(len(rejected)))
+    if rejects is not None:
+        rejects.append(rejected)
+
+
+# A complete report, decoded to get the columns of a batch without AAXX reports
+_TEMPLATE_REPORT = ('AAXX 23033 96745 13966 31639 11191 20048 30724 49857 58019 7//// '
+                    '90352 333 10100 20050 55100 60051 70009 84140 91015 553// 555 12458=')
+_empty_results = {}
+
+
+def _empty_result(timeseries):
+    '''Empty final_df and df_climat with the columns and dtypes of a decoded batch.'''
+    if timeseries not in _empty_results:
+        df = pd.DataFrame({'Station': ['96745'], 'Year': [2018], 'Month': [2], 'Day': [23],
+                           'Hour': [3], 'Minute': [0], 'Report': [_TEMPLATE_REPORT],
+                           'time': [pd.Timestamp(2018, 2, 23, 3)]})
+        final_df, df_climat = _decode(df, timeseries)
+        _empty_results[timeseries] = (final_df.iloc[:0], df_climat.iloc[:0])
+    final_df, df_climat = _empty_results[timeseries]
+    return final_df.copy(), df_climat.copy()
+
+
+def _decode(df, timeseries=False, timings=None, rejects=None):
+    '''
+    Decodes the reports of a DataFrame as returned by load_main (see synop_df).
+    If a dict is given as timings, the seconds spent per stage are added to it.
+    If a list is given as rejects, the table of rejected reports and groups is
+    appended to it.
+    '''
+    start = time.perf_counter()
+    # Load the compiled station index
+    stations = load_station_index()
+    start = _lap(timings, 'station index', start)
+
+    # Reports without a valid time or text are rejected as a whole
+    no_time = df['time'].isna()
+    no_report = df['Report'].isna()
+    rejected = [pd.DataFrame({'Station': df['Station'][mask], 'time': df['time'][mask],
+                              'fields': 'report', 'group': df['Report'][mask],
+                              'reason': reason})
+                for mask, reason in [(no_time, 'invalid date'),
+                                     (no_report & ~no_time, 'empty report')] if mask.any()]
+    df = df[~no_time & ~no_report]
 
     # Do some cleaning up of the dataframe
     # only valid station IDs
@@ -85,54 +769,43 @@ def synop_df(path, timeseries=False):
     except TypeError:
         df = df[df['Station'] != 00000]
     df['Report'] = df['Report'].str.split('=').str[0]
+    if df.empty:
+        # No AAXX report left, e.g. only ship reports or everything rejected
+        final_df, df_climat = _empty_result(timeseries)
+        _log_rejects(rejected, rejects)
+        return final_df, df_climat
 
     # Get the first 5 groups that every synop contains
     df[['Type', 'Dat', 'Statindex', 'iihVV', 'Nddff',
-        'Rest']] = df['Report'].str.split(' ', n=5, expand=True)
+        'Rest']] = df['Report'].str.split(' ', n=5, expand=True).reindex(columns=range(6))
+    start = _lap(timings, 'clean', start)
 
-    # Split after '333' etc. - indication of climatic data (eg 24h precip)
-    split_list = [' 555 ', ' 333 ', ' 222']
-    for x in split_list:
-        try:
-            df[x] = df['Rest'].str.split(x, n=1, expand=True)[1]
-            df['Rest'] = df['Rest'].str.split(x, n=1, expand=True)[0]
-        except KeyError:
-            print('Error when handling {} group!'.format(x))
+    # Split off the sections 222 (ships), 333 (climatic data, eg 24h precip)
+    # and 555, section 1 stays in 'Rest'
+    sections = split_sections(df['Rest'])
+    df[['Rest', '222', '333', '555']] = sections[['1', '222', '333', '555']]
+    start = _lap(timings, 'sections', start)
 
     # Sort all the values from the '333' group in corresponding columns
     try:
         list1 = ['X1', 'X2', 'X3', 'X4', 'X5', 'X6', 'X7', 'X8', 'X9']
-        df_climat = df[' 333 '].str.split(' ', expand=True, n=8)
+        df_climat = df['333'].str.split(' ', expand=True)
         shp = np.shape(df_climat)[1]
         list_cols = [x+'_333' for x in list1]
         df_climat.fillna(value='XXXXX', inplace=True)
 
-        for x in range(1, 10):
-            for y in range(0, shp):
-                if y == 0:
-                    df_climat[list_cols[x-1]] = (df_climat[y]
-                                                 [df_climat[y].str.startswith(str(x))])
-                else:
-                    (df_climat[list_cols[x-1]][df_climat[y].
-                                               str.startswith(str(x))]) = (df_climat[y][df_climat[y].str.
-                                                                                        startswith(str(x))])
-        df_climat.fillna(value='XXXXX', inplace=True)
-        # WIP: START
-        # Extract the mag gust values 910 = max gust 10 mins prior, 911 max gust hour,
-        # 912 - highest mean wind speed
-        for x in ['910', '911', '912', '913', '914']:
-            for y in range(0, 9):
-                if y == 0:
-                    df_climat[x] = (df_climat[df_climat.columns[y]].
-                                    loc[df_climat[df_climat.columns[y]].str.startswith(x)])
-                else:
-                    df_climat[x].loc[df_climat[df_climat.columns[y]].str.startswith(x)] = (
-                        df_climat[df_climat.columns[y]].loc[df_climat[df_climat.columns[y]].
-                                                            str.startswith(x)])
+        # 910 = max gust 10 mins prior, 911 max gust hour, 912 - highest mean
+        # wind speed, 55SSS daily and 553SS hourly sunshine
+        list_gusts = ['910', '911', '912', '913', '914']
+        list_sun = ['550', '551', '552', '553']
+        groups_333 = _match_groups(df_climat, list('123456789') + list_gusts + list_sun,
+                                   list_cols + list_gusts + list_sun)
+        df_climat[list_cols + list_gusts] = groups_333[list_cols + list_gusts]
         df_climat.fillna(value='XXXXX', inplace=True)
 
     except KeyError:
         print('No climate data available')
+    start = _lap(timings, 'groups 333', start)
 
     # ----- STANDARD OBSERVATIONS ------------------------------------------
     # Create new df with only the first group of observations (standard observations)
@@ -145,217 +818,162 @@ def synop_df(path, timeseries=False):
     max_iter = np.shape(df_new)[1]
 
     # This looks for gusts >= 100 in main part of Synop
-    for x in range(1, 10):
-        for y in range(0, max_iter):
-            if y == 0:
-                df_new['max_gt_100'] = df_new[y][df_new[y].str.startswith(
-                    str('00'))]
-                df_new[list1[x-1]
-                       ] = df_new[y][df_new[y].str.startswith(str(x))]
-            else:
-                df_new[list1[x-1]][df_new[y].str.startswith(str(x))] = (df_new[y][df_new[y].str
-                                                                                  .startswith(str(x))])
+    df_new['max_gt_100'] = df_new[0][df_new[0].str.startswith('00')]
+    df_new[list1] = _match_groups(df_new[list(range(max_iter))], list('123456789'), list1)
 
     df_new.fillna(value='XXXXX', inplace=True)
-    df_new = df_new.replace(r'^\s*$', 'XXXXX', regex=True)
     # Print all the stations with gusts >= 100 knots or m/s
     df_new['max_gt_100'][df_new['max_gt_100'].str.startswith('00')]
 
+    start = _lap(timings, 'groups section 1', start)
+
     # =======================================================================================
     # ======================= EXTRACT ALL THE DATA ==========================================
     # =======================================================================================
+    # Every group is decoded into integers with a validity mask on a fixed-width
+    # view of its characters, conversion to float happens once per column
     df.fillna(np.nan, inplace=True)
     df = df.replace('NIL', np.nan)
     final_df = pd.DataFrame()
     final_df['Station'] = df['Statindex']
-    # Extract cloud cover
-    df['clouds'] = df['Nddff'].str[0].fillna('/')
-    df['clouds'].loc[df['clouds'].str.contains('\D')] = '/'
-    final_df['cloud_cover'] = df['clouds'].replace(
-        '/', 10).astype(int)
+    # The fields of malformed groups are masked (NaN), they are logged here
+
+    def codes_of(fields, group):
+        codes = _group_codes(group)
+        rejected.append(_malformed_groups(df, fields, group, codes))
+        return codes
+
+    # Extract cloud cover (10 if not reported)
+    nddff = codes_of('cloud_cover, dd, ff', df['Nddff'])
+    nddff_digits, nddff_is_digit = _digits(nddff)
+    final_df['cloud_cover'] = np.where(nddff_is_digit[:, 0], nddff_digits[:, 0],
+                                       10).astype(int)
 
     # Retrieve if station is automatic or manned
-    df['StationType'] = df['iihVV'].str[1].fillna('/')
-    df['StationType'].loc[df['StationType'].str.contains('\D')] = '/'
-    final_df['StationType'] = pd.to_numeric(
-        df['StationType'].replace('/', np.nan))
+    digits, is_digit = _digits(codes_of('StationType', df['iihVV']))
+    final_df['StationType'] = _as_float(digits[:, 1], is_digit[:, 1])
     # extract the wind direction and convert to degress
-    df['dd'] = df['Nddff'].str[1:3].fillna('//')
-    df['dd'].loc[df['dd'].str.contains('\D')] = '//'
-    final_df['dd'] = (pd.to_numeric(
-        df['dd'].replace('//', np.nan))) * 10
+    dd, valid = _decode_pair(nddff, 1)
+    final_df['dd'] = _as_float(dd, valid) * 10
     # Identify if wind obs. is in m/s (0,1) or knots (3,4)
-    identifier = df['Dat'].str[4]
+    digits, is_digit = _digits(_group_codes(df['Dat']))
+    in_ms = is_digit[:, 4] & (digits[:, 4] <= 1)
     # Extract wind speed and check for units. Convert all to knots
-    df['ff'] = df['Nddff'].str[3:5].fillna('//')
-    df['ff'].loc[df['ff'].str.contains('\D')] = '//'
-    ff = pd.to_numeric(df['ff'].replace('//', np.nan))
-    (ff.loc[(identifier == '0') | (identifier == '1').values]
-     ) *= units('m/s').to('knots')
-    ff = ff.astype('float')
-    final_df['ff'] = ff.values
-    # ff = (pd.to_numeric((df['Nddff'].str[3:5].str.replace(r'(^.*/.*$)', '//'))
-    #                     .replace('//', np.nan))).fillna(np.nan)
-    # syntax to change only a subset of the df
-    # (ff.loc[(identifier == '0') | (identifier == '1').values]) *= units('m/s').to('knots')
-    # final_df['ff'] = ff.values
-
-    # Extract Temperature and assign + or - by dividing through 10 or -10
-    list_to_drop = ['XXXXX', '/////', '10///', '10']
-    df_new['X1'].loc[df_new['X1'].str.contains('\D')] = 'XXXXX'
-    # Entries not long enough will be replaced
-    df_new['X1'].loc[df_new['X1'].str.len() < 5] = 'XXXXX'
-    df_new['X1'] = df_new['X1'].replace(r'^\s*$', 'XXXXX', regex=True)
-    df_new['XT'] = df_new['X1'][~df_new['X1'].isin(list_to_drop)]
-    final_df['TT'] = df_new['XT'].loc[df_new['XT'].str[1]
-                                      == '0'].str[2:].astype(int)/10
-    final_df['TT'].loc[df_new['XT'].str[1] == '1'] = (df_new['XT'].loc[df_new['XT']
-                                                                       .str[1] == '1'].str[2:5].astype(int)/-10)
-    # Extract Td and assign + or - sign
-    list_to_drop = ['XXXXX', '/////', '20///', '20']
-    df_new['X2'].loc[df_new['X2'].str.contains('\D')] = 'XXXXX'
-    # Entries not long enough will be replaced
-    df_new['X2'].loc[df_new['X2'].str.len() < 5] = 'XXXXX'
-    df_new['X2'] = df_new['X2'].replace(r'^\s*$', 'XXXXX', regex=True)
-    df_new['XTD'] = df_new['X2'][~df_new['X2'].isin(list_to_drop)]
-    final_df['TD'] = df_new['XTD'].loc[df_new['XTD'].str[1]
-                                       == '0'].str[2:].astype(int)/10
-    final_df['TD'].loc[df_new['XTD'].str[1] == '1'] = (df_new['XTD'].loc[df_new['XTD']
-                                                                         .str[1] == '1'].str[2:5]
-                                                       .astype(int)/-10)
-
-    # Extract the station pressure
-    list_to_drop = ['XXXXX', '/////', '30///']
-    df_new['X3'].loc[df_new['X3'].str.contains('\D')] = 'XXXXX'
-    df_new['XP'] = df_new['X3'][~df_new['X3'].isin(list_to_drop)]
-    final_df['PP'] = (df_new['XP'].loc[df_new['XP'].str[1] == '0'].str[1:]
-                      .astype(int) + 10000)/10
-    for x in ['9', '8', '7']:
-        final_df['PP'].loc[df_new['XP'].str[1] == x] = (df_new['XP'].loc[df_new['XP'].str[1]
-                                                                         == x].str[1:].astype(int)/10)
-
-    # Extract the reduced sea level pressure
-    list_to_drop = ['XXXXX', '/////', '30///', '48///']
-    df_new['X4'].loc[df_new['X4'].str.contains('\D')] = 'XXXXX'
-    df_new['XSLP'] = df_new['X4'][~df_new['X4'].isin(list_to_drop)]
-    final_df['SLP'] = (df_new['XSLP'].loc[df_new['XSLP'].str[1] == '0'].str[1:]
-                       .astype(int) + 10000)/10
-    for x in ['9', '8', '7']:
-        final_df['SLP'].loc[df_new['XSLP'].str[1] == x] = (df_new['XSLP'].loc[df_new['XSLP']
-                                                                              .str[1] == x].str[1:]
-                                                           .astype(int)/10)
+    ff, valid = _decode_pair(nddff, 3)
+    ff = _as_float(ff, valid)
+    final_df['ff'] = np.where(in_ms, ff * MS_TO_KNOTS, ff)
+
+    # Extract Temperature and Td (tenths of degC, sign digit 0 or 1)
+    for col, group in [('TT', 'X1'), ('TD', 'X2')]:
+        tenths, valid = _decode_temperature(codes_of(col, df_new[group]))
+        final_df[col] = _as_float(tenths, valid, 10)
+
+    # Extract the station pressure and the reduced sea level pressure
+    for col, group in [('PP', 'X3'), ('SLP', 'X4')]:
+        tenths, valid = _decode_pressure(codes_of(col, df_new[group]))
+        final_df[col] = _as_float(tenths, valid, 10)
 
     # Extract the pressure tendency and assign - or +
-    list_to_drop = ['XXXXX', 'XXX', '/////', '5////']
-    df_new['X5'] = df_new['X5'].str[2:]
-    df_new['X5'].loc[df_new['X5'].str.contains(
-        '/', case=False)] = 'XXX'
-    df_new['X5'].loc[df_new['X5'].str.contains('\D')] = 'XXXXX'
-    df_new['X5'] = df_new['X5'].replace(r'^\s*$', 'XXX', regex=True)
-    df_new['PT'] = df_new['X5'][~df_new['X5'].isin(
-        list_to_drop)].astype(int)
-
-    final_df['Ptendency'] = df_new['PT']
-    for x in ['5', '6', '7', '8']:
-        final_df['Ptendency'].loc[df_new['X5'].str[1] == x] = (final_df['Ptendency'].loc
-                                                               [df_new['X5'].str[1]
-                                                                == x] * (-1))
+    tenths, valid = _decode_tendency(codes_of('Ptendency', df_new['X5']))
+    final_df['Ptendency'] = _as_float(tenths, valid)
 
     # Extract the precipitation data
-    # df_new['X6'] = df_new['X6'].str[2:]
-    # df_new['X6'].loc[df_new['X6'].str.contains('/', case=False)] = 'XXXXX'
-    # df_new['RR'] = df_new['X6'][~df_new['X6'].isin(list_to_drop)].str[2:].astype(int)
     # Apparently all the precip data is in '333' group
 
     # Extract current current weather
-    list_to_drop = ['XX']
-    df_new['Cweather'] = df_new['X7'].str[1:3]
-    df_new['Cweather'].loc[df_new['Cweather'].str.contains(
-        '/', case=False)] = 'XX'
-    df_new['Cweather'].loc[df_new['Cweather'].str.contains(
-        '\D')] = 'XX'
-    df_new['Cweather'] = df_new['Cweather'].replace(
-        r'^\s*$', 'XX', regex=True)
-    final_df['ww'] = df_new['Cweather'][~df_new['Cweather'].isin(
-        list_to_drop)].astype(int)
-    final_df['ww'] = pd.to_numeric(
-        final_df['ww'], downcast='integer', errors='ignore')
-
-    # Extract past weather
-    list_to_drop = ['XX']
-    df_new['Pweather'] = df_new['X7'].str[3:5]
-    df_new['Pweather'].loc[df_new['Pweather'].str.contains(
-        '/', case=False)] = 'XX'
-    df_new['Pweather'].loc[df_new['Pweather'].str.contains(
-        '\D')] = 'XX'
-    df_new['Pweather'] = df_new['Pweather'].replace(
-        r'^\s*$', 'XX', regex=True)
-    final_df['WW'] = df_new['Pweather'][~df_new['Pweather'].isin(
-        list_to_drop)].astype(int)
-    final_df['WW'] = pd.to_numeric(
-        final_df['ww'], downcast='integer', errors='ignore')
+    ww, valid = _decode_pair(codes_of('ww, WW', df_new['X7']), 1)
+    final_df['ww'] = pd.to_numeric(pd.Series(_as_float(ww, valid), index=final_df.index),
+                                   downcast='integer')
+    # WW has so far been filled from ww, kept as is
+    final_df['WW'] = final_df['ww']
 
     # Only if df_climat exists
     if 'df_climat' in locals():
         # Extract mag gust from df_climat
-        list_to_drop = ['XX']
-        df_new['max_gust'] = df_climat['911'].str[3:5]
-        df_new['max_gust'].loc[df_new['max_gust'].str.contains(
-            '\D')] = 'XX'
-        final_df['max_gust'] = df_new['max_gust'][~df_new['max_gust'].isin(
-            list_to_drop)].astype(int)
-
-        (final_df['max_gust'].loc[(identifier == '0') | (identifier == '1').values]) *= (units('m/s')
-                                                                                         .to('knots'))
-        final_df['max_gust'] *= units('knots').to('kph')
+        gust, valid = _decode_pair(codes_of('max_gust', df_climat['911']), 3)
+        gust = _as_float(gust, valid)
+        final_df['max_gust'] = (np.where(in_ms, gust * MS_TO_KNOTS, gust) *
+                                KNOTS_TO_KPH)
 
         # Extract precip data
-        df_climat.fillna('XXXXX', inplace=True)
-        df_climat['X6_333'].loc[df_climat['X6_333'].str.contains(
-            '//')] == 'XXXXX'
-        list_to_drop = ['XXX', '///']
-        df_new['Precip'] = df_climat['X6_333'].str[1:4]
-        df_new['Precip'].loc[df_new['Precip'].str.contains(
-            '\D')] = 'XXX'
-        df_new['Precip_h'] = df_climat['X6_333'].str[4]
-
-        final_df['Precip'] = df_new['Precip'][~df_new['Precip'].isin(
-            list_to_drop)].astype(int)
-        final_df['Precip'].loc[final_df['Precip'] >= 991] = (
-            final_df['Precip'] - 990) / 10
-        final_df['Precip'].loc[final_df['Precip'] == 990] = 0.01
+        codes = codes_of('Precip', df_climat['X6_333'])
+        digits, is_digit = _digits(codes)
+        precip, valid = (digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3],
+                         is_digit[:, 1:4].all(axis=1))
+        precip = _as_float(precip, valid)
+        # 990 is a trace, 991-999 are 0.1 to 0.9 mm
+        precip = np.where(precip >= 991, (precip - 990) / 10, precip)
+        precip = np.where(precip == 990, 0.01, precip)
+        final_df['Precip'] = precip
 
         hour_list = [6, 12, 18, 24, 1, 2, 3, 9, 15]
+        precip_h = np.where(is_digit[:, 4], digits[:, 4], -1)
         for x in range(0, 9):
             s = 'Precip_' + str(hour_list[x]) + 'h'
-            final_df[s] = final_df['Precip'].loc[df_new['Precip_h'] == str(
-                x+1)]
-            # print(s)
-        final_df['Precip_24h'].loc[df_new['Precip_h'] == '/'] = (final_df['Precip'].
-                                                                 loc[df_new['Precip_h'] == '/'])
+            final_df[s] = np.where(precip_h == x + 1, precip, np.nan)
+        final_df['Precip_24h'] = np.where(codes[:, 4] == ord('/'), precip,
+                                          final_df['Precip_24h'])
+
+        # 24h precipitation 7R24R24R24R24 in tenths of mm, 9999 is a trace
+        digits, is_digit = _digits(codes_of('RR24', df_climat['X7_333']))
+        rr24 = digits[:, 1] * 1000 + digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4]
+        rr24 = _as_float(rr24, is_digit[:, 1:5].all(axis=1), 10)
+        final_df['RR24'] = np.where(rr24 == 999.9, 0.01, rr24)
+
+        # Max and min temperature 1snTxTxTx and 2snTnTnTn
+        for col, group in [('Tmax', 'X1_333'), ('Tmin', 'X2_333')]:
+            tenths, valid = _decode_temperature(codes_of(col, df_climat[group]))
+            final_df[col] = _as_float(tenths, valid, 10)
+
+        # State of ground and snow depth 4E'sss in cm, 997 is less than 0.5 cm,
+        # 998 and 999 are patchy cover and not measurable
+        codes = codes_of('ground_state, snow_depth', df_climat['X4_333'])
+        digits, is_digit = _digits(codes)
+        fits = codes[:, 5] == 0
+        final_df['ground_state'] = _as_float(digits[:, 1], is_digit[:, 1] & fits)
+        sss = digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4]
+        valid = is_digit[:, 2:5].all(axis=1) & fits & (sss >= 1) & (sss <= 997)
+        final_df['snow_depth'] = _as_float(np.where(sss == 997, 0, sss), valid)
+
+        # Sunshine duration 55SSS (day) and 553SS (last hour) in hours
+        sun = groups_333['550'].fillna(groups_333['551']).fillna(groups_333['552'])
+        digits, is_digit = _digits(codes_of('sunshine_24h', sun))
+        sss = digits[:, 2] * 100 + digits[:, 3] * 10 + digits[:, 4]
+        final_df['sunshine_24h'] = _as_float(sss, is_digit[:, 2:5].all(axis=1) &
+                                             (sss <= 240), 10)
+        sun, valid = _decode_pair(codes_of('sunshine_1h', groups_333['553']), 3)
+        final_df['sunshine_1h'] = _as_float(sun, valid & (sun <= 10), 10)
+
+        # Remaining 91x wind groups in knots
+        for x in ['910', '912', '913', '914']:
+            speed, valid = _decode_pair(codes_of('ff_' + x, df_climat[x]), 3)
+            speed = _as_float(speed, valid)
+            final_df['ff_' + x] = np.where(in_ms, speed * MS_TO_KNOTS, speed)
     else:
         df_climat = pd.DataFrame()
+    _log_rejects(rejected, rejects)
     # Possible plot option: plt.plot(final_df['Precip_1h'][final_df['Precip_1h'].notnull()])
     # Precip_6h Precip_12h Precip_18h Precip_24h Precip_1h Precip_2h Precip_3h Precip_9h
     # Precip_15h
-    # Merge with latlon data
-    final_df = final_df.merge(
-        df_latlon, left_on='Station', right_on='Station')
-    final_df['longitude'].loc[final_df['E_or_W'] == 'W'] = (final_df['longitude'].
-                                                            loc[final_df['E_or_W']
-                                                                == 'W']
-                                                            * (-1))
-    final_df['latitude'].loc[final_df['N_or_S'] == 'S'] = (final_df['latitude'].
-                                                           loc[final_df['N_or_S']
-                                                               == 'S']
-                                                           * (-1))
+    start = _lap(timings, 'decode', start)
+    # Add the station metadata, stations not in the index are dropped
+    rows = _station_lookup(final_df['Station'], stations)
+    final_df = final_df[rows >= 0].copy()
+    rows = rows[rows >= 0]
+    for col in STATION_COLUMNS:
+        values = stations[col][rows]
+        if col in STATION_TEXT:
+            values = pd.Series(values, index=final_df.index).replace('', np.nan)
+        final_df[col] = values
+    start = _lap(timings, 'stations', start)
     # Add time to the final dataframe
     df_test = df[['Statindex', 'time']]
     if timeseries is False:
         final_df = final_df.merge(
             df_test, left_on='Station', right_on='Statindex')
     else:
-        final_df['time'] = df_test['time']
+        final_df['time'] = df_test['time'].reindex(final_df.index)
+        final_df = final_df.reset_index(drop=True)
     # Round time to nearest hour
     final_df['time'] = final_df['time'].dt.round('60min')
 
@@ -363,4 +981,5 @@ def synop_df(path, timeseries=False):
         # Final drop of duplicates
         final_df = final_df.drop_duplicates('Station')
 
+    _lap(timings, 'time', start)
     return final_df, df_climat
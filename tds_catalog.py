@@ -0,0 +1,60 @@
+'''
+Cached access to the NetCDF subset service (NCSS) of THREDDS (TDS) datasets.
+
+Opening a dataset downloads and parses the catalog.xml and then the dataset
+description of the NCSS. Both are kept for CATALOG_TTL seconds, so all maps
+and products of a run share one set of metadata requests per dataset.
+
+Examples:
+---------
+from tds_catalog import get_ncss
+from metar_download import METAR_CATALOG
+ncss = get_ncss(METAR_CATALOG)
+query = ncss.query()
+'''
+import threading
+import time
+
+# Seconds after which the catalog and the dataset description are requested again
+CATALOG_TTL = 600
+# (catalog url, dataset) -> (time of the request, NCSS)
+_ncss_cache = {}
+_ncss_lock = threading.Lock()
+
+
+def get_ncss(catalog_url, dataset=0, ttl=CATALOG_TTL):
+    '''
+    Returns the NCSS of a dataset of a TDS catalog, reusing the one of an
+    earlier call if it is younger than ttl.
+
+    Arguments:
+    ----------
+    catalog_url (url of the catalog.xml)
+    dataset = 0 (position of the dataset in the catalog)
+    ttl = CATALOG_TTL (maximum age in seconds of the cached metadata)
+
+    Returns:
+    --------
+    siphon NCSS of the dataset, its variables are in ncss.variables
+
+    '''
+    key = (catalog_url, dataset)
+    # Concurrent callers wait for the first request instead of repeating it
+    with _ncss_lock:
+        cached = _ncss_cache.get(key)
+        if cached is not None and time.time() - cached[0] < ttl:
+            return cached[1]
+        from siphon.catalog import TDSCatalog
+        from siphon.ncss import NCSS
+        catalog = TDSCatalog(catalog_url)
+        ds = list(catalog.datasets.values())[dataset]
+        ncss = NCSS(ds.access_urls['NetcdfSubset'])
+        print('Loaded the metadata of {} ({} variables).'.format(ds.name, len(ncss.variables)))
+        _ncss_cache[key] = (time.time(), ncss)
+        return ncss
+
+
+def clear_cache():
+    '''Forgets all cached catalogs, the next get_ncss requests them again.'''
+    with _ncss_lock:
+        _ncss_cache.clear()